@@ -22,9 +22,19 @@
 # --------------------------------
 # Import Modules
 import os, arcpy
+import datetime
+import numpy as np
 import SharedArcNumericalLib as san
 import itertools
 
+try:
+    import pandas as pd
+except:
+    arcpy.AddError(
+        "This library requires Pandas installed in the ArcGIS Python Install."
+        " Might require installing pre-requisite libraries and software."
+    )
+
 
 # Function Definitions
 def constructChainedSQLQuery(
@@ -77,14 +87,121 @@ def constructUniqueStringID(values, delimiter="."):
     return final_chained_id
 
 
-def create_class_group_field(in_fc, input_fields, basename="GROUP_"):
+def load_group_dictionary(dictionary_table):
+    """Reads a persisted group dictionary table of GROUP_KEY and GROUP_ID fields. The reserved row with a GROUP_ID of
+    0 holds the latest edit stamp processed by the last run.
+    :param - dictionary_table - path to the dictionary table
+    :returns - tuple of (dictionary of {group key: group id}, edit stamp string or None)
+    """
+    group_dictionary, edit_stamp = {}, None
+    with arcpy.da.SearchCursor(dictionary_table, ["GROUP_KEY", "GROUP_ID"]) as cursor:
+        for group_key, group_id in cursor:
+            if group_id == 0:
+                edit_stamp = group_key or None
+            else:
+                group_dictionary[group_key] = group_id
+    return group_dictionary, edit_stamp
+
+
+def load_hashed_group_dictionary(dictionary_table):
+    """Reads a persisted group dictionary table whose GROUP_KEY values are 64-bit hashed keys stored as hexadecimal
+    text into sorted numpy arrays.
+    :param - dictionary_table - path to the dictionary table
+    :returns - tuple of (group_keys sorted uint64 array, group_ids int64 array, edit stamp string or None)
+    """
+    group_keys, group_ids, edit_stamp = [], [], None
+    with arcpy.da.SearchCursor(dictionary_table, ["GROUP_KEY", "GROUP_ID"]) as cursor:
+        for group_key, group_id in cursor:
+            if group_id == 0:
+                edit_stamp = group_key or None
+            else:
+                group_keys.append(int(group_key, 16))
+                group_ids.append(group_id)
+    group_keys = np.array(group_keys, dtype="uint64")
+    key_order = np.argsort(group_keys)
+    return (
+        group_keys[key_order],
+        np.array(group_ids, dtype="int64")[key_order],
+        edit_stamp,
+    )
+
+
+def save_group_dictionary(dictionary_table, new_groups, edit_stamp=None):
+    """Appends new groups to a persisted group dictionary table, creating the table if it does not exist, and
+    stores the edit stamp in the reserved row with a GROUP_ID of 0. A new table sizes GROUP_KEY to hold its longest
+    key (at least 255 characters). Keys longer than the GROUP_KEY field of an existing table raise a ValueError
+    instead of being truncated, since a truncated key would not match its group on later runs.
+    :param - dictionary_table - path to the dictionary table
+    :param - new_groups - list of (group key, group id) pairs to append
+    :param - edit_stamp - optional edit stamp string to record for the next run"""
+    key_length = max([len(str(group_key)) for group_key, _ in new_groups] + [255])
+    if not arcpy.Exists(dictionary_table):
+        arcpy.CreateTable_management(
+            os.path.dirname(dictionary_table), os.path.basename(dictionary_table)
+        )
+        san.add_new_field(
+            dictionary_table, "GROUP_KEY", "TEXT", field_length=key_length
+        )
+        san.add_new_field(dictionary_table, "GROUP_ID", "LONG")
+    else:
+        field_length = arcpy.ListFields(dictionary_table, "GROUP_KEY")[0].length
+        if key_length > field_length:
+            raise ValueError(
+                "A group key of {0} characters does not fit the {1} character GROUP_KEY field of {2}. "
+                "Use a new dictionary table or hashed keys.".format(
+                    key_length, field_length, dictionary_table
+                )
+            )
+    with arcpy.da.InsertCursor(dictionary_table, ["GROUP_KEY", "GROUP_ID"]) as cursor:
+        for group in new_groups:
+            cursor.insertRow(group)
+    if edit_stamp is None:
+        return
+    stamp_query = "{0} = 0".format(
+        arcpy.AddFieldDelimiters(dictionary_table, "GROUP_ID")
+    )
+    with arcpy.da.UpdateCursor(
+        dictionary_table, ["GROUP_KEY"], where_clause=stamp_query
+    ) as cursor:
+        for row in cursor:
+            cursor.updateRow([edit_stamp])
+            return
+    with arcpy.da.InsertCursor(dictionary_table, ["GROUP_KEY", "GROUP_ID"]) as cursor:
+        cursor.insertRow([edit_stamp, 0])
+
+
+def create_class_group_field(
+    in_fc,
+    input_fields,
+    basename="GROUP_",
+    dictionary_table="",
+    edit_stamp_field="",
+    hashed_keys=False,
+    text_labels=True,
+):
     """This function will take in a feature class and create a numeric group ID field and a string field
     representing the unique combination of values for each row, joining them back to the feature class using arcpy.
+    The class fields are read in one pass and grouped with a multi-column factorization, labels are built once per
+    group, and both fields are written back in one update pass.
         Parameters
     -----------------
     in_fc- input feature class to add class group fields
     input_fields - input fields to build a unique group id from
-    basename- base name for group fields."""
+    basename- base name for group fields.
+    dictionary_table - optional table that persists the group dictionary as GROUP_KEY and GROUP_ID fields. A table
+    name without a folder is placed in the workspace of the feature class. Later runs give existing groups their saved
+    IDs, append IDs for unseen groups only, and process only rows without a group ID. Without an edit stamp field,
+    rows that already have a group ID keep it even if their class values changed, so clear the group ID of edited
+    rows (or recreate the field) to regroup them.
+    edit_stamp_field - optional date field (such as an editor tracking last edited date) used with the dictionary
+    table to also process rows edited since the last run. The stamp saved for the next run is read after the group
+    fields are written, so the edits this tool makes to an editor tracked field are not processed again. Edits made
+    in the same second as that write are not picked up.
+    hashed_keys - if true, groups are keyed by a 64-bit hash of the field values of each row and kept in sorted numpy
+    arrays, with a verification pass that raises an error on hash collisions. Rows are read and grouped in chunks,
+    so memory depends on the number of groups rather than on a full table of class values. Dictionary tables then
+    store keys as hexadecimal text, so a dictionary table should always be used with the same key mode.
+    text_labels - if false, the text label field is not added or written."""
     try:
         arcpy.env.overwriteOutput = True
         desc = arcpy.Describe(in_fc)
@@ -96,30 +213,153 @@ def create_class_group_field(in_fc, input_fields, basename="GROUP_"):
             "{0}_Text".format(basename), workspace
         )
         san.add_new_field(in_fc, valid_num_field, "LONG")
-        san.add_new_field(in_fc, valid_text_field, "TEXT")
-        san.arc_print("Constructing class groups within dictionary.", True)
-        unique_class_dict = {}
-        cursor_fields = input_Fields_List + [valid_text_field, valid_num_field]
-        with arcpy.da.UpdateCursor(in_fc, cursor_fields) as cursor:
-            counter = 0
-            group_id = 1
-            for row in cursor:
-                try:
-                    group_field_values = row[:-2]  # Grab all but last two fields.
-                    unique_id = constructUniqueStringID(group_field_values)
-                    if unique_id not in unique_class_dict:
-                        unique_class_dict[unique_id] = group_id
-                        group_id += 1
-                    row[-1] = unique_class_dict[unique_id]
-                    row[-2] = unique_id
-                    cursor.updateRow(row)
-                    counter += 1
-                except Exception as e:
+        if text_labels:
+            san.add_new_field(in_fc, valid_text_field, "TEXT")
+        query, group_dictionary, last_edit_stamp = "", {}, None
+        dictionary_keys = np.empty(0, dtype="uint64")
+        dictionary_ids = np.empty(0, dtype="int64")
+        if dictionary_table:
+            if not os.path.dirname(dictionary_table):
+                dictionary_table = os.path.join(workspace, dictionary_table)
+            if arcpy.Exists(dictionary_table):
+                san.arc_print("Loading group dictionary.", True)
+                if hashed_keys:
+                    dictionary_keys, dictionary_ids, last_edit_stamp = (
+                        load_hashed_group_dictionary(dictionary_table)
+                    )
+                else:
+                    group_dictionary, last_edit_stamp = load_group_dictionary(
+                        dictionary_table
+                    )
+                # Only rows without a group ID or edited since the last run are processed
+                query = "{0} IS NULL".format(
+                    arcpy.AddFieldDelimiters(in_fc, valid_num_field)
+                )
+                if edit_stamp_field and last_edit_stamp:
+                    query = "{0} OR {1} >= date '{2}'".format(
+                        query,
+                        arcpy.AddFieldDelimiters(in_fc, edit_stamp_field),
+                        last_edit_stamp,
+                    )
+                elif not edit_stamp_field:
                     san.arc_print(
-                        "ERROR: Skipped at iteration {0}. QAQC.".format(counter), True
+                        "Only rows without a group ID are grouped. Rows whose class values changed keep "
+                        "their group ID unless an edit stamp field is used."
                     )
-                    san.arc_print(str(e.args[0]))
-        del unique_class_dict
+        stamp_fields = (
+            [edit_stamp_field] if dictionary_table and edit_stamp_field else []
+        )
+        san.arc_print("Reading class fields.", True)
+        # Group IDs are numbered in the order groups are first read, and null values form their own groups
+        if hashed_keys:
+            # Hashed keys are grouped chunk by chunk, so only the object IDs and group of each row are kept
+            oid_chunks = []
+
+            def class_chunks():
+                with arcpy.da.SearchCursor(
+                    in_fc, ["OID@"] + input_Fields_List, where_clause=query
+                ) as cursor:
+                    while True:
+                        rows = list(itertools.islice(cursor, 1000000))
+                        if not rows:
+                            break
+                        oid_chunks.append(
+                            np.array([row[0] for row in rows], dtype="int64")
+                        )
+                        yield [row[1:] for row in rows]
+
+            field_types = {
+                field.name.upper(): field.type for field in arcpy.ListFields(in_fc)
+            }
+            san.arc_print(
+                "Constructing class groups from hashed field combinations.", True
+            )
+            group_keys, group_values, group_index = san.hashed_group_index(
+                class_chunks(),
+                input_Fields_List,
+                [field_types[field.upper()] for field in input_Fields_List],
+            )
+            oids = (
+                np.concatenate(oid_chunks) if oid_chunks else np.empty(0, dtype="int64")
+            )
+        else:
+            with arcpy.da.SearchCursor(
+                in_fc, ["OID@"] + input_Fields_List, where_clause=query
+            ) as cursor:
+                rows = [row for row in cursor]
+            san.arc_print(
+                "Constructing class groups from unique field combinations.", True
+            )
+            class_df = pd.DataFrame(rows, columns=["OID@"] + input_Fields_List)
+            group_index = (
+                class_df.groupby(input_Fields_List, sort=False, dropna=False)
+                .ngroup()
+                .to_numpy(dtype="int64")
+            )
+            _, first_rows = np.unique(group_index, return_index=True)
+            group_values = [rows[row][1:] for row in first_rows.tolist()]
+            oids = class_df["OID@"].to_numpy()
+        group_labels = None
+        if text_labels or (dictionary_table and not hashed_keys):
+            group_labels = np.array(
+                [constructUniqueStringID(values) for values in group_values],
+                dtype=object,
+            )
+        group_ids = np.arange(1, len(group_values) + 1, dtype="int64")
+        new_groups = []
+        if dictionary_table and hashed_keys:
+            key_positions = np.searchsorted(dictionary_keys, group_keys)
+            known = key_positions < len(dictionary_keys)
+            known[known] = dictionary_keys[key_positions[known]] == group_keys[known]
+            group_ids[known] = dictionary_ids[key_positions[known]]
+            next_id = int(dictionary_ids.max(initial=0)) + 1
+            group_ids[~known] = np.arange(next_id, next_id + (~known).sum())
+            new_groups = [
+                ("{0:016x}".format(group_key), group_id)
+                for group_key, group_id in zip(
+                    group_keys[~known].tolist(), group_ids[~known].tolist()
+                )
+            ]
+        elif dictionary_table:
+            next_id = max(group_dictionary.values(), default=0) + 1
+            for index, group_label in enumerate(group_labels):
+                if group_label not in group_dictionary:
+                    group_dictionary[group_label] = next_id
+                    new_groups.append((group_label, next_id))
+                    next_id += 1
+                group_ids[index] = group_dictionary[group_label]
+        san.arc_print("Writing class groups to fields.", True)
+        field_arrays = {valid_num_field: group_ids[group_index]}
+        if text_labels:
+            field_arrays[valid_text_field] = group_labels[group_index]
+        san.update_rows_from_arrays(in_fc, oids, field_arrays, query)
+        if dictionary_table:
+            edit_stamp = last_edit_stamp
+            if stamp_fields:
+                # Read after the write, as editor tracking stamps the rows this tool just updated. The
+                # rows are matched by object ID, as the query no longer selects them once they have a group ID
+                written_oids = set(oids.tolist())
+                with arcpy.da.SearchCursor(in_fc, ["OID@"] + stamp_fields) as cursor:
+                    stamps = [
+                        stamp
+                        for oid, stamp in cursor
+                        if stamp is not None and oid in written_oids
+                    ]
+                if stamps:
+                    # Whole seconds only, so the next run starts at the second after the latest stamp
+                    next_stamp = max(stamps).replace(
+                        microsecond=0
+                    ) + datetime.timedelta(seconds=1)
+                    edit_stamp = max(
+                        next_stamp.strftime("%Y-%m-%d %H:%M:%S"), last_edit_stamp or ""
+                    )
+            san.arc_print(
+                "Saving {0} new groups to the group dictionary.".format(
+                    len(new_groups)
+                ),
+                True,
+            )
+            save_group_dictionary(dictionary_table, new_groups, edit_stamp)
         san.arc_print("Script Completed Successfully.", True)
 
     except arcpy.ExecuteError:
@@ -138,4 +378,16 @@ if __name__ == "__main__":
     FeatureClass = arcpy.GetParameterAsText(0)  # r"C:"
     InputFields = arcpy.GetParameterAsText(1)  # "CBSA_POP;D5cri"
     BaseName = arcpy.GetParameterAsText(2)  # "GROUP"
-    create_class_group_field(FeatureClass, InputFields, BaseName)
+    DictionaryTable = arcpy.GetParameterAsText(3)
+    EditStampField = arcpy.GetParameterAsText(4)
+    HashedKeys = arcpy.GetParameter(5)
+    TextLabels = arcpy.GetParameter(6)
+    create_class_group_field(
+        FeatureClass,
+        InputFields,
+        BaseName,
+        dictionary_table=DictionaryTable,
+        edit_stamp_field=EditStampField,
+        hashed_keys=HashedKeys,
+        text_labels=TextLabels,
+    )
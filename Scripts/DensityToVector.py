@@ -28,6 +28,9 @@
 # Import Modules
 import arcpy
 import numpy as np
+import os
+import shutil
+import tempfile
 
 import SharedArcNumericalLib as san
 
@@ -47,6 +50,131 @@ except:
 # Function Definitions
 
 
+def split_search_radii(search_radius):
+    """Returns the search radii as a list of floats from a number, a list, or a semicolon separated string (the
+    multivalue parameter format)."""
+    if isinstance(search_radius, str):
+        search_radius = [value for value in search_radius.split(";") if value.strip()]
+    elif not isinstance(search_radius, (list, tuple)):
+        search_radius = [search_radius]
+    return [float(str(value)) for value in search_radius]
+
+
+def radius_suffix(search_radius):
+    """Returns the field name suffix for a search radius, _400 for 400.0 or _400p5 for 400.5."""
+    radius_text = "{0:g}".format(float(search_radius))
+    return "_" + radius_text.replace(".", "p")
+
+
+def sample_field_density(
+    in_fc,
+    field,
+    sample_xy,
+    input_network,
+    cell_size,
+    search_radius,
+    area_unit,
+    barrier_fc="",
+    intermediate_raster="",
+    raster_sampling="BILINEAR",
+    extent=None,
+    snap_grid=None,
+):
+    """Computes a Spatial Analyst kernel density for one weighted field and samples the raster array at the sample
+    point coordinates. Safe to run in a worker process: rasters are built in a private scratch folder and no sample
+    point features are written. An optional (x_min, y_min, x_max, y_max) extent limits the raster to one tile, and
+    an optional snap grid (see san.raster_grid) becomes the snap raster, so tiles share the cells of one grid. The
+    scratch folder is removed and the arcpy environments it sets are restored when it returns.
+    :returns - tuple of field and the (N,) density array of the sample points"""
+    saved_environments = {
+        name: getattr(arcpy.env, name)
+        for name in (
+            "overwriteOutput",
+            "scratchWorkspace",
+            "extent",
+            "outputCoordinateSystem",
+            "snapRaster",
+        )
+    }
+    scratch_folder = tempfile.mkdtemp(prefix="density_to_vector_")
+    try:
+        arcpy.env.overwriteOutput = True
+        arcpy.env.scratchWorkspace = scratch_folder
+        arcpy.env.extent = arcpy.Extent(*extent) if extent else input_network
+        # Build the raster in the network's spatial reference so it lines up with the sample coordinates
+        network_sr = arcpy.Describe(input_network).spatialReference
+        arcpy.env.outputCoordinateSystem = network_sr
+        if snap_grid:
+            arcpy.env.snapRaster = san.create_snap_raster(
+                snap_grid, os.path.join(scratch_folder, "snap_raster.tif"), network_sr
+            )
+        output_kde = arcpy.sa.KernelDensity(
+            in_fc,
+            str(field),
+            cell_size,
+            search_radius,
+            area_unit,
+            in_barriers=barrier_fc,
+        )
+        if intermediate_raster:
+            san.arc_print("Generating an intermediate raster...")
+            output_kde.save(intermediate_raster)
+        density_array, grid = san.raster_to_array_grid(output_kde)
+        # Release the scratch raster before its folder is removed
+        del output_kde
+        sample_values = san.sample_raster_array(
+            density_array, grid, sample_xy, raster_sampling
+        )
+    finally:
+        for name, value in saved_environments.items():
+            setattr(arcpy.env, name, value)
+        shutil.rmtree(scratch_folder, ignore_errors=True)
+    return field, sample_values
+
+
+def fft_tile_density(
+    point_xy,
+    point_weights,
+    tile_grid,
+    search_radii,
+    area_factor,
+    sample_xy,
+    raster_sampling="BILINEAR",
+    raster_path="",
+    full_grid=None,
+    core_window=None,
+    halo_window=None,
+):
+    """Computes FFT density surfaces for every radius and field on one tile's halo grid and samples them at the
+    tile's sample points. With a raster path, the tile's core cells are written into the shared memory-mapped
+    intermediate raster, which other tiles write to in disjoint windows.
+    :returns - (N, radii * fields) sample density array"""
+    field_count = point_weights.shape[1]
+    surfaces = np.empty(
+        (len(search_radii) * field_count, tile_grid[3], tile_grid[4]), dtype="float64"
+    )
+    for radius_index, radius in enumerate(search_radii):
+        san.fft_kernel_density(
+            point_xy,
+            point_weights,
+            tile_grid,
+            radius,
+            area_factor,
+            out=surfaces[radius_index * field_count : (radius_index + 1) * field_count],
+        )
+    if raster_path:
+        row_start, row_stop, col_start, col_stop = core_window
+        row_offset, col_offset = halo_window[0], halo_window[2]
+        raster = san.open_multiband_raster(raster_path, full_grid, len(surfaces))
+        raster[:, row_start:row_stop, col_start:col_stop] = surfaces[
+            :,
+            row_start - row_offset : row_stop - row_offset,
+            col_start - col_offset : col_stop - col_offset,
+        ]
+        raster.flush()
+    return san.sample_raster_array(surfaces, tile_grid, sample_xy, raster_sampling)
+
+
 def density_to_vector(
     in_fc,
     weighted_fields,
@@ -60,6 +188,16 @@ def density_to_vector(
     group_by_statistic="median",
     barrier_fc="",
     intermediate_raster="",
+    density_engine="RASTER",
+    workers=1,
+    sample_cache_folder="",
+    sampling_mode="PERCENTAGE",
+    sample_distance=None,
+    max_sample_points=None,
+    raster_sampling="BILINEAR",
+    tile_size=None,
+    zonal=False,
+    max_snap_distance=None,
 ):
     """This function will compute kernel densities and associate them with a target network/vector file. If the
     percentile bool is true, percentile scores are added along side each density.
@@ -71,7 +209,9 @@ def density_to_vector(
     percentile_bool: if true, adds percentiles to scores
     field_edit: prepended field name
     cell_size: cell size of KDE raster
-    search_radius: search radius/bandwidth of KDE
+    search_radius: search radius/bandwidth of KDE, or a list of radii (semicolon separated text is accepted). With
+        several radii, neighbors are found once at the largest radius where the engine allows it, and every field
+        gets DN_/Per_ fields suffixed with the radius, such as DN_POP_400.
     area_unit: unit of output raster
     sample_percentage: determines the sample point density for polyline files. 10 will give 1 point every 10% of the line.
        Includes stop and end points.
@@ -80,6 +220,34 @@ def density_to_vector(
             https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.agg.html.
     barrier_fc: a feature class (line or polygon) that defines a barrier for KDE estimation.
     intermediate_raster: The output save location for intermediate raster files from the kernel density.
+    density_engine: RASTER computes a Spatial Analyst KernelDensity raster per field and extracts it at the sample
+        points. KDTREE evaluates the same quartic kernel for every field directly at the sample points with a
+        KD-tree and a sparse matrix product, skipping the raster. FFT bins every field onto one grid and convolves
+        the stack with the kernel by FFT, and saves all surfaces as one multiband intermediate raster (a memory
+        mapped .bsq file, or a composite raster in a geodatabase). NETWORK measures kernel distances along a
+        polyline input network, densified to cell_size, with cutoff bounded shortest paths from the snapped input
+        points, so density does not cross rivers or freeways without a connecting link. Barriers require RASTER
+        (NETWORK ignores them).
+    workers: number of processes computing RASTER field densities or NETWORK source batches at once (-1 uses
+        every core).
+    sample_cache_folder: optional folder that stores sample point coordinates and parent IDs as .npz files, keyed by
+        the network geometry and sample percentage. Later runs on the same network load them instead of
+        regenerating the sample points.
+    sampling_mode: how polylines are sampled. PERCENTAGE places a point every sample_percentage of each line,
+        DISTANCE a point every sample_distance map units, and COUNT max_sample_points evenly spaced points.
+        Polygons and points are sampled at their label point.
+    sample_distance: spacing of polyline sample points in map units for the DISTANCE mode.
+    max_sample_points: points per line for COUNT, and the optional cap on points per line for the other modes.
+    raster_sampling: how the RASTER and FFT density surfaces are read at the sample points, BILINEAR (as
+        ExtractValuesToPoints with interpolation) or NEAREST.
+    tile_size: optional tile width in map units for the RASTER and FFT engines. The network extent is split into
+        tiles aligned to the cell grid, each computed with a halo of search_radius plus one cell (in parallel with
+        workers) so memory is bounded by the tile, and sample values are stitched back from the tile cores.
+    zonal: for polygon networks, samples every density grid cell whose center falls inside a polygon instead of
+        one label point, so group_by_statistic summarizes the whole zone. Polygons smaller than a cell fall back to
+        their label point.
+    max_snap_distance: largest distance in map units between an input point and the NETWORK engine's graph.
+        Farther points are dropped with a warning. Defaults to the largest search radius.
     """
     try:
         arcpy.env.overwriteOutput = True
@@ -88,77 +256,279 @@ def density_to_vector(
         work_space = desc.catalogPath
         arcpy.env.scratchWorkspace = "memory"  # Scratch in memory
         arcpy.env.extent = input_network  # Set extent to input network, rather than default point extent
-        temp_out_sample = "memory/sample_points_out"
-        temp_sample_points = "memory/sample_points"
-        temp_input_layer = "Temp_Input_Layer"
-        join_field = "JNField"
         join_index = "JNindex"
         oid_field = str(desc.OIDFieldName)
-        san.add_new_field(input_network, join_field, "LONG")
-        arcpy.CalculateField_management(
-            input_network, join_field, "!{0}!".format(oid_field), "PYTHON"
-        )
-        san.arc_print("Generating sample points from feature class in memory...")
-        san.generate_sample_points(
-            input_network, temp_sample_points, int(sample_percentage)
-        )
-        final_df = None
-        for field in weighted_fields:
-            san.arc_print("Computing density for field {0}...".format(field))
-            arcpy.MakeFeatureLayer_management(
-                in_fc,
-                temp_input_layer,
-                san.construct_sql_equality_query(
-                    field, None, work_space, noneEqualityOperator="is not"
-                ),
+        density_engine = str(density_engine).upper()
+        if density_engine == "NETWORK" and str(desc.shapeType) != "Polyline":
+            arcpy.AddWarning(
+                "The NETWORK density engine requires a polyline network. Using KDTREE."
+            )
+            density_engine = "KDTREE"
+        if density_engine == "NETWORK" and (barrier_fc or intermediate_raster):
+            arcpy.AddWarning(
+                "Network distances follow the input network, so barriers and "
+                "intermediate rasters are not used by the NETWORK density engine."
+            )
+        if density_engine not in ("RASTER", "NETWORK") and barrier_fc:
+            arcpy.AddWarning(
+                "Barriers require the RASTER density engine. Using RASTER."
+            )
+            density_engine = "RASTER"
+        if density_engine == "KDTREE" and intermediate_raster:
+            arcpy.AddWarning(
+                "The KDTREE engine does not build rasters. "
+                "Using FFT for the intermediate raster."
+            )
+            density_engine = "FFT"
+        search_radii = split_search_radii(search_radius)
+        # Density columns are ordered by radius, then field. Fields get a radius suffix only for several radii.
+        density_columns = [
+            (field, radius, radius_suffix(radius) if len(search_radii) > 1 else "")
+            for radius in search_radii
+            for field in weighted_fields
+        ]
+        network_sr = desc.spatialReference
+        grid = san.raster_grid(desc.extent, cell_size)
+        if zonal and str(desc.shapeType) != "Polygon":
+            arcpy.AddWarning(
+                "Zonal summaries require a polygon network. Ignoring zonal."
             )
-            output_kde = arcpy.sa.KernelDensity(
+            zonal = False
+        if zonal:
+            san.arc_print("Sampling polygons at the density grid cells they contain...")
+            sample_xy, sample_parents = san.zonal_sample_arrays(
+                input_network, grid, network_sr
+            )
+        else:
+            san.arc_print("Generating sample points from feature class...")
+            sample_xy, sample_parents = san.sample_point_arrays(
+                input_network,
+                int(sample_percentage),
+                sample_cache_folder,
+                network_sr,
+                sampling_mode,
+                sample_distance,
+                max_sample_points,
+            )
+        if density_engine != "RASTER":
+            area_factor = 1.0 / san.geometry_conversion_factor(network_sr, area_unit)
+            _, point_xy, point_weights = san.arcgis_points_to_arrays(
                 in_fc,
-                str(field),
-                cell_size,
-                search_radius,
-                area_unit,
-                in_barriers=barrier_fc,
-            )
-            if intermediate_raster:
-                san.arc_print("Generating an intermediate raster...")
-                output_kde.save(intermediate_raster)
-            arcpy.sa.ExtractValuesToPoints(
-                temp_sample_points, output_kde, temp_out_sample, True
-            )
-            raw_sample_df = san.arcgis_table_to_df(
-                temp_out_sample, [join_field, "RASTERVALU"]
-            )
-            new_field_name = "DN_" + str(field_edit) + str(field)
-            raw_sample_df[new_field_name] = raw_sample_df["RASTERVALU"]
-            raw_sample_df[new_field_name].fillna(0, inplace=True)
-            raw_sample_df = raw_sample_df.groupby(join_field).agg(
-                str(group_by_statistic).lower()
+                [str(field) for field in weighted_fields],
+                spatial_reference=network_sr,
             )
-            if percentile_bool:
-                new_percentile_field = "Per_" + str(field_edit) + str(field)
-                raw_sample_df[new_percentile_field] = raw_sample_df[
-                    new_field_name
-                ].rank(pct=True)
-            field_list = (
-                [new_field_name, new_percentile_field]
-                if percentile_bool
-                else [new_field_name]
-            )
-            if final_df is not None:
-                final_df = pd.concat([final_df, raw_sample_df[field_list]], axis=1)
+        tiles, tile_sample_index = None, {}
+        if tile_size and density_engine in ("RASTER", "FFT"):
+            # Halos hold every cell a tile's samples read and every point within the search radius of them
+            tiles = san.grid_tiles(
+                grid, float(tile_size), max(search_radii) + float(cell_size)
+            )
+            order, segment_starts, tile_ids = san.segment_sort(
+                san.grid_tile_index(grid, float(tile_size), sample_xy)
+            )
+            tile_sample_index = dict(zip(tile_ids, np.split(order, segment_starts[1:])))
+            san.arc_print(
+                "Computing densities in {0} tiles of {1} cells...".format(
+                    len(tiles), san.grid_tile_cells(grid, tile_size) ** 2
+                )
+            )
+        if density_engine == "KDTREE":
+            san.arc_print("Computing densities at sample points with a KD-tree...")
+            sample_densities = san.kernel_density_at_points(
+                point_xy, point_weights, sample_xy, search_radii, area_factor
+            )
+        elif density_engine == "NETWORK":
+            san.arc_print("Computing network distance densities at sample points...")
+            _, network_coords, network_offsets, _ = san.arcgis_geometry_to_arrays(
+                input_network, spatial_reference=network_sr
+            )
+            node_xy, network_graph = san.network_graph_arrays(
+                network_coords, network_offsets, float(cell_size)
+            )
+            sample_densities = san.network_kernel_density(
+                node_xy,
+                network_graph,
+                point_xy,
+                point_weights,
+                sample_xy,
+                search_radii,
+                area_factor,
+                workers,
+                max_snap_distance=max_snap_distance,
+            )
+        elif density_engine == "FFT" and tiles:
+            raster_workspace = os.path.dirname(str(intermediate_raster)).lower()
+            raster_path = ""
+            if intermediate_raster and raster_workspace.endswith((".gdb", ".sde")):
+                arcpy.AddWarning(
+                    "Tiled intermediate rasters are written as .bsq files in a folder. "
+                    "Skipping the geodatabase intermediate raster."
+                )
+            elif intermediate_raster:
+                raster_path = intermediate_raster
+                # Tiles reopen the file to write their cores
+                san.create_multiband_raster(
+                    intermediate_raster, grid, len(density_columns), network_sr
+                ).flush()
+            tile_arguments, tile_samples = [], []
+            for tile_index, (core_window, halo_window) in enumerate(tiles):
+                samples = tile_sample_index.get(tile_index, np.empty(0, dtype="int64"))
+                if len(samples) == 0 and not raster_path:
+                    continue
+                tile_grid = san.window_grid(grid, halo_window)
+                x_min, y_min, x_max, y_max = san.grid_extent(
+                    tile_grid, max(search_radii)
+                )
+                near_tile = (
+                    (point_xy[:, 0] >= x_min)
+                    & (point_xy[:, 0] <= x_max)
+                    & (point_xy[:, 1] >= y_min)
+                    & (point_xy[:, 1] <= y_max)
+                )
+                tile_samples.append(samples)
+                tile_arguments.append(
+                    (
+                        point_xy[near_tile],
+                        point_weights[near_tile],
+                        tile_grid,
+                        search_radii,
+                        area_factor,
+                        sample_xy[samples],
+                        raster_sampling,
+                        raster_path,
+                        grid,
+                        core_window,
+                        halo_window,
+                    )
+                )
+            sample_densities = np.full(
+                (len(sample_xy), len(density_columns)), np.nan, dtype="float64"
+            )
+            for samples, tile_densities in zip(
+                tile_samples,
+                san.process_pool_map(fft_tile_density, tile_arguments, workers),
+            ):
+                sample_densities[samples] = tile_densities
+        elif density_engine == "FFT":
+            san.arc_print("Computing stacked density surfaces with FFT convolution...")
+            raster_workspace = os.path.dirname(str(intermediate_raster)).lower()
+            memory_mapped = intermediate_raster and not raster_workspace.endswith(
+                (".gdb", ".sde")
+            )
+            if memory_mapped:
+                surfaces = san.create_multiband_raster(
+                    intermediate_raster, grid, len(density_columns), network_sr
+                )
             else:
-                raw_sample_df[join_index] = raw_sample_df.index
-                final_df = raw_sample_df[[join_index] + field_list]
+                surfaces = np.empty(
+                    (len(density_columns), grid[3], grid[4]), dtype="float64"
+                )
+            for radius_index, radius in enumerate(search_radii):
+                field_bands = slice(
+                    radius_index * len(weighted_fields),
+                    (radius_index + 1) * len(weighted_fields),
+                )
+                san.fft_kernel_density(
+                    point_xy,
+                    point_weights,
+                    grid,
+                    radius,
+                    area_factor,
+                    out=surfaces[field_bands],
+                )
+            if memory_mapped:
+                surfaces.flush()
+            elif intermediate_raster:
+                san.write_multiband_raster(
+                    surfaces, grid, intermediate_raster, network_sr
+                )
+            sample_densities = san.sample_raster_array(
+                surfaces, grid, sample_xy, raster_sampling
+            )
+        if density_engine == "FFT" and intermediate_raster:
+            san.arc_print(
+                "Saved intermediate raster with bands in order: {0}".format(
+                    [
+                        "{0}{1}".format(field, suffix)
+                        for field, radius, suffix in density_columns
+                    ]
+                )
+            )
+        if density_engine in ("KDTREE", "NETWORK"):
+            sample_densities = np.concatenate(list(sample_densities), axis=1)
+        if density_engine == "RASTER":
+            if tiles and intermediate_raster:
+                arcpy.AddWarning(
+                    "Intermediate rasters are not saved when RASTER runs in tiles."
+                )
+            tile_windows = [(None, np.arange(len(sample_xy)))]
+            if tiles:
+                tile_windows = [
+                    (
+                        san.grid_extent(san.window_grid(grid, halo_window)),
+                        tile_sample_index[tile_index],
+                    )
+                    for tile_index, (core_window, halo_window) in enumerate(tiles)
+                    if tile_index in tile_sample_index
+                ]
+            field_arguments, field_targets = [], []
+            for tile_extent, samples in tile_windows:
+                for column_index, (field, radius, suffix) in enumerate(density_columns):
+                    # Only the last field's raster was kept when fields ran in sequence
+                    keep_raster = not tiles and column_index == len(density_columns) - 1
+                    field_targets.append((samples, column_index))
+                    field_arguments.append(
+                        (
+                            in_fc,
+                            field,
+                            sample_xy[samples],
+                            input_network,
+                            cell_size,
+                            radius,
+                            area_unit,
+                            barrier_fc,
+                            intermediate_raster if keep_raster else "",
+                            raster_sampling,
+                            tile_extent,
+                            grid,
+                        )
+                    )
+            field_workers = min(san.resolve_worker_count(workers), len(field_arguments))
+            if field_workers > 1:
+                san.arc_print(
+                    "Computing field densities in {0} processes...".format(
+                        field_workers
+                    )
+                )
+            sample_densities = np.full(
+                (len(sample_xy), len(density_columns)), np.nan, dtype="float64"
+            )
+            for (samples, column_index), (field, sample_values) in zip(
+                field_targets,
+                san.process_pool_map(
+                    sample_field_density, field_arguments, field_workers
+                ),
+            ):
+                sample_densities[samples, column_index] = sample_values
+        san.arc_print("Aggregating sample point densities to features...")
+        order, segment_starts, parent_ids = san.segment_sort(sample_parents)
+        densities = san.segment_reduce(
+            sample_densities, order, segment_starts, group_by_statistic
+        )
+        final_df = pd.DataFrame({join_index: parent_ids}, index=parent_ids)
+        for column_index, (field, radius, suffix) in enumerate(density_columns):
+            new_field_name = "DN_" + str(field_edit) + str(field) + suffix
+            final_df[new_field_name] = densities[:, column_index]
+            if percentile_bool:
+                new_percentile_field = "Per_" + str(field_edit) + str(field) + suffix
+                final_df[new_percentile_field] = final_df[new_field_name].rank(pct=True)
         final_df.reset_index()
         san.arc_print("Extending density fields to table...")
         final_df = san.validate_df_names(final_df, work_space)
-        fin_records = final_df.to_records()
+        fin_records = final_df.to_records(index=False)
         arcpy.da.ExtendTable(
-            input_network, join_field, fin_records, join_index, append_only=False
+            input_network, oid_field, fin_records, join_index, append_only=False
         )
-        san.arc_print("Deleting temporary join field...")
-        arcpy.DeleteField_management(input_network, [join_field, join_index])
         san.arc_print("Script Completed Successfully.", True)
 
     except arcpy.ExecuteError:
@@ -187,6 +557,17 @@ if __name__ == "__main__":
     group_by_stat = arcpy.GetParameter(9)
     barrier_fc = arcpy.GetParameterAsText(10)
     intermediate_ra = arcpy.GetParameterAsText(11)
+    # Parameter 12 is the derived output network
+    density_engine = arcpy.GetParameterAsText(13) or "RASTER"
+    workers = arcpy.GetParameter(14)
+    sample_cache_folder = arcpy.GetParameterAsText(15)
+    sampling_mode = arcpy.GetParameterAsText(16) or "PERCENTAGE"
+    sample_distance = arcpy.GetParameter(17)
+    max_sample_points = arcpy.GetParameter(18)
+    raster_sampling = arcpy.GetParameterAsText(19) or "BILINEAR"
+    max_snap_distance = arcpy.GetParameter(20)
+    tile_size = arcpy.GetParameter(21)
+    zonal = arcpy.GetParameter(22)
     density_to_vector(
         input_feature_class,
         weighted_fields,
@@ -200,4 +581,14 @@ if __name__ == "__main__":
         group_by_stat,
         barrier_fc,
         intermediate_ra,
+        density_engine=density_engine,
+        workers=1 if workers is None else int(workers),
+        sample_cache_folder=sample_cache_folder,
+        sampling_mode=sampling_mode,
+        sample_distance=sample_distance,
+        max_sample_points=max_sample_points,
+        raster_sampling=raster_sampling,
+        max_snap_distance=max_snap_distance,
+        tile_size=tile_size,
+        zonal=bool(zonal),
     )
@@ -28,6 +28,10 @@ import arcpy, os, datetime, re
 import pandas as pd
 import numpy as np
 
+# The shared library lives in the parent Scripts folder. This experiment is not a toolbox tool, so run it with the
+# Scripts folder on the Python path (for example by adding it to PYTHONPATH).
+import SharedArcNumericalLib as san
+
 # Define Inputs
 # Temporal Params
 inFeatureClass = arcpy.GetParameterAsText(0)
@@ -335,86 +339,105 @@ def temporal_aggregate_field(inFeatureClass, outFeatureClass, start_time, end_ti
             except:
                 arcPrint("Could not refresh catalog.")
                 pass
-            # Set up Time Deltas and Parse Time String
-            arcPrint("Constructing Time Delta from input time period string.", True)
-            arcPrint(str(time_interval))
-            time_magnitude, time_unit = alphanumeric_split(str(time_interval))
-            time_delta = parse_time_units_to_dt(time_magnitude, time_unit)
-            arcPrint(
-                    "Using datetime fields to generate new feature classes in {0}.".format(
-                            str(workSpaceTail)))
-            arcPrint("Getting start and final times in start time field {0}.".format(start_time))
-            start_time_min, start_time_max = get_min_max_from_field(inFeatureClass, start_time)
+            weight_field, case_field, summary_field = [str(field) if field and str(field) not in ("#", "") else None
+                                                       for field in (weight_field, case_field, summary_field)]
             # Establish whether to use end time field or only a start time (Single Date Field)
             if FieldExist(inFeatureClass, end_time) and end_time:
                 arcPrint("Using start and end time to grab feature classes whose bins occur within an events "
                          "start or end time.")
-                end_time_min, end_time_max = get_min_max_from_field(inFeatureClass, end_time)
                 start_time_field = start_time
                 end_time_field = end_time
-                start_time_range = start_time_min
-                end_time_range = end_time_max
             else:
                 arcPrint("Using only first datetime start field to construct time bin ranges.")
                 start_time_field = start_time
                 end_time_field = start_time
-                start_time_range = start_time_min
-                end_time_range = start_time_max
+            # The input is read once and every event is binned in one vectorized pass instead of a query per bin
+            arcPrint("Reading event times, locations and summary fields into memory.", True)
+            read_fields = []
+            for field in [start_time_field, end_time_field, "SHAPE@X", "SHAPE@Y", weight_field, case_field,
+                          summary_field]:
+                if field and field not in read_fields:
+                    read_fields.append(field)
+            event_dataframe = san.arcgis_table_to_df(inFeatureClass, read_fields)
             if isinstance(bin_start, datetime.datetime) or isinstance(bin_start, datetime.date):
-                start_time_range = bin_start
                 arcPrint("Bin Start Time was selected, using {0} as bin starting time period."
-                         .format(str(bin_start_time)))
-            time_bins = construct_time_bin_ranges(start_time_range, end_time_range, time_delta)
+                         .format(str(bin_start)))
+            else:
+                bin_start = None
+            arcPrint("Binning events by time interval {0}.".format(str(time_interval)), True)
+            bin_codes, bin_edges = san.datetime_bin_codes(event_dataframe[start_time_field], str(time_interval),
+                                                          bin_start, event_dataframe[end_time_field].max(),
+                                                          event_dataframe[end_time_field])
+            bin_count = len(bin_edges) - 1
+            # Each bin and case value pair is one group, and all groups are summarized with bincount reductions
+            if case_field:
+                # Null case values get their own code after the other case values
+                case_codes, case_values = pd.factorize(event_dataframe[case_field])
+                case_values = list(case_values)
+                if (case_codes < 0).any():
+                    case_codes = np.where(case_codes < 0, len(case_values), case_codes)
+                    case_values.append(None)
+            else:
+                case_codes, case_values = np.zeros(len(event_dataframe), dtype="int64"), [None]
+            case_count = len(case_values)
+            group_count = bin_count * case_count
+            group_codes = np.where(bin_codes >= 0, bin_codes * case_count + case_codes, -1)
+            binned = group_codes >= 0
+            weights = event_dataframe[weight_field].fillna(0).to_numpy(dtype="float64") if weight_field else \
+                np.ones(len(event_dataframe))
+            event_counts = np.bincount(group_codes[binned], minlength=group_count)
+            weight_sums = np.bincount(group_codes[binned], weights[binned], group_count)
+            # Groups whose weights sum to zero fall back to the unweighted mean center of their events
+            zero_weight = weight_sums == 0
+            weights = np.where(zero_weight[np.where(binned, group_codes, 0)], 1.0, weights)
+            weight_sums = np.where(zero_weight, event_counts, weight_sums)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean_x = np.bincount(group_codes[binned], (weights * event_dataframe["SHAPE@X"].to_numpy())[binned],
+                                     group_count) / weight_sums
+                mean_y = np.bincount(group_codes[binned], (weights * event_dataframe["SHAPE@Y"].to_numpy())[binned],
+                                     group_count) / weight_sums
+            if summary_field:
+                arcPrint("Computing bin statistics of summary field {0}.".format(summary_field), True)
+                group_statistics = san.bin_statistics(group_codes, event_dataframe[summary_field], group_count)
+            else:
+                group_statistics = np.full((group_count, 7), np.nan)
+                group_statistics[:, 0] = event_counts
+            # Time bins and their queries are only built for bins that hold events
+            output_groups = np.flatnonzero(event_counts)
+            output_bins = np.unique(output_groups // case_count)
+            bin_edge_times = bin_edges.astype("datetime64[us]")
+            time_bins = dict(zip(output_bins.tolist(), zip(bin_edge_times[output_bins].tolist(),
+                                                           bin_edge_times[output_bins + 1].tolist())))
             arcPrint("Constructing queries based on datetime ranges.")
-            temporal_queries = construct_sql_queries_from_time_bin(time_bins, inFeatureClass, start_time_field,
-                                                                   end_time_field)
-            temporary_fc_name = "Temp_{1}".format(
-                    arcpy.ValidateTableName(inFeatureClassTail, fin_output_workspace)[0:13])
-            temporary_fc_path = os.path.join(fin_output_workspace, temporary_fc_name)
-            # Transition to kernel density creation
-            time_counter = 0
+            temporal_queries = dict(zip(time_bins, construct_sql_queries_from_time_bin(
+                list(time_bins.values()), inFeatureClass, start_time_field, end_time_field)))
             temporal_record_table = []
-            arcPrint("Generating kernel densities based on {0} queries.".format(len(temporal_queries)), True)
-            for query in temporal_queries:
-                try:
-                    time_counter += 1
-                    arcPrint("Determining name and constructing query for new feature class.", True)
-                    # Break up general density to have pop field set to none if no actually field exists.
-
-                    temporary_layer = arcpy.MakeFeatureLayer_management(inFeatureClass, temporary_fc_name, query)
-                    tempoary_dataframe = ArcGISTabletoDataFrame()
-                    arcPrint(
-                            "Created Mean Center {0} with query [{1}], appending to master feature class.".format(
-                                    temporary_fc_name, str(query)), True)
-                    arcpy.MeanCenter_stats(temporary_layer, temporary_fc_path, weight_field, case_field)
-                    start_date_time = time_bins[time_counter - 1][0]
-                    end_date_time = time_bins[time_counter - 1][1]
-                    start_bin_time_string = str(start_date_time)
-                    end_bin_time_string = str(end_date_time)
-                    if not workspace_is_geodatabase:
-                        arcpy.AddWarning("DBF tables can only accept date fields, not datetimes."
-                                         " Please check string field.")
-                        start_date_time = start_date_time.date()
-                        end_date_time = end_date_time.date()
-                    temporal_record_table.append([time_counter, start_date_time, end_date_time,
-                                                  start_bin_time_string, end_bin_time_string, query])
-
-                except Exception as e:
-                    arcPrint(
-                            "The feature bin ID {0}, could not be processed. Check arguments".format(
-                                    str(query)))
-                    arcpy.AddWarning(str(e.args[0]))
-                    pass
-
-            # arc_print("Adding record values to Temporal Table with an insert cursor.")
-            # table_fields= get_fields(outFeatureClass)
-            # with arcpy.da.InsertCursor(outFeatureClass,table_fields) as cursor:
-            #     for records in temporal_record_table:
-            #         cursor.insertRow(records)
-            #     arc_print("Finished inserting records for database.")
-            #     del cursor
-            # arc_print("Tool execution complete.", True)
-            pass
+            for group in output_groups.tolist():
+                bin_index, case_value = group // case_count, case_values[group % case_count]
+                start_date_time, end_date_time = time_bins[bin_index]
+                start_bin_time_string = str(start_date_time)
+                end_bin_time_string = str(end_date_time)
+                if not workspace_is_geodatabase:
+                    start_date_time = start_date_time.date()
+                    end_date_time = end_date_time.date()
+                unique_id = str(bin_index + 1) if case_value is None else "{0}_{1}".format(bin_index + 1, case_value)
+                bin_statistics = [None if np.isnan(statistic) else statistic for statistic in
+                                  group_statistics[group].tolist()]
+                temporal_record_table.append([(float(mean_x[group]), float(mean_y[group])), unique_id, bin_index + 1,
+                                              start_date_time, end_date_time, start_bin_time_string,
+                                              end_bin_time_string, temporal_queries[bin_index]] + bin_statistics)
+            if not workspace_is_geodatabase:
+                arcpy.AddWarning("DBF tables can only accept date fields, not datetimes. Please check string field.")
+
+            arcPrint("Adding record values to Temporal Table with an insert cursor.")
+            table_fields = ["SHAPE@XY"] + [arcpy.ValidateFieldName(field, fin_output_workspace) for field in
+                                           ["Unique_ID", "Bin_Number", "DT_Start_Bin", "DT_End_Bin", "TXT_Start_Bin",
+                                            "TXT_End_Bin", "Extract_Query", "Bin_Count", "Bin_Mean", "Bin_Median",
+                                            "Bin_Sum", "Bin_StdDev", "Bin_Min", "Bin_Max"]]
+            with arcpy.da.InsertCursor(outFeatureClass, table_fields) as cursor:
+                for records in temporal_record_table:
+                    cursor.insertRow(records)
+            arcPrint("Tool execution complete.", True)
         else:
             arcPrint("The desired workspace does not exist. Tool execution terminated.", True)
             arcpy.AddWarning("The desired workspace does not exist.")
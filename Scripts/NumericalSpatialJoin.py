@@ -25,14 +25,125 @@
 
 # Import Modules
 import arcpy
+import os
+import numpy as np
 import SharedArcNumericalLib as san
 
 
 # Function Definitions
 
+INTEGER_FIELD_DTYPES = {"SmallInteger": "<i2", "Integer": "<i4", "BigInteger": "<i8"}
+VALUE_MERGE_RULES = ("FIRST", "LAST", "MIN", "MAX", "MODE")
+
+
+def merge_rule_dtype(merge_rule, field_type, values):
+    """Returns the numpy dtype of a merge rule output field, so ExtendTable creates it with the type of its join
+    field. COUNT is a LONG, rules returning one of the join values keep the join field type, and SUM and RANGE of
+    integer fields stay integers while their values fit. Other rules are DOUBLE."""
+    merge_rule = str(merge_rule).upper()
+    if merge_rule == "COUNT":
+        return "<i4"
+    if merge_rule in VALUE_MERGE_RULES:
+        dtype = INTEGER_FIELD_DTYPES.get(field_type, "<f4" if field_type == "Single" else "<f8")
+    elif merge_rule in ("SUM", "RANGE") and field_type in INTEGER_FIELD_DTYPES:
+        dtype = "<i8" if field_type == "BigInteger" else "<i4"
+    else:
+        return "<f8"
+    if np.dtype(dtype).kind == "i":
+        finite_values = values[~np.isnan(values)]
+        limits = np.iinfo(dtype)
+        if len(finite_values) and (finite_values.min() < limits.min or finite_values.max() > limits.max):
+            return "<f8"
+    return dtype
+
+
+def merge_rule_spatial_join(target_feature, join_features, out_feature_class, prepended_field_name="", join_type=True,
+                            match_option="INTERSECT", search_radius=None, merge_rule_dict={}, pair_cache_folder=""):
+    """Joins merge rule statistics of join feature fields to a copy of the target features. The match pairs are
+    computed once, every merge rule is evaluated for all of its fields as a grouped numpy reduction over the pairs,
+    and the results are added to the output with one ExtendTable call. SUM, MEAN, MIN, MAX, RANGE and COUNT are
+    scattered into their targets with bincount accumulation, and the other rules sort the pairs by target once.
+    Output fields keep the *merge rule*+*prepended_name*+*fieldname* names of generate_statistical_fieldmap,
+    alongside Join_Count and TARGET_FID as SpatialJoin writes them. The copy carries the target object IDs in
+    TARGET_FID, which ExtendTable joins the statistics on. Statistic fields take their type from merge_rule_dtype.
+    Targets without matches get a Join_Count of 0 and null statistics, or are removed when join_type is
+    KEEP_COMMON. A pair cache folder reuses the match pairs of earlier runs on unchanged geometry (see
+    san.spatial_join_pairs).
+    :returns - out_feature_class"""
+    keep_all = join_type in (True, "KEEP_ALL")
+    out_workspace = os.path.dirname(out_feature_class)
+    field_types = {field.name: field.type for field in arcpy.ListFields(join_features)}
+    join_fields = []
+    for merge_rule in merge_rule_dict:
+        join_fields += [field for field in merge_rule_dict[merge_rule] if field not in join_fields]
+    san.arc_print("Computing spatial join match pairs...")
+    target_ids, join_ids = san.spatial_join_pairs(target_feature, join_features, match_option, search_radius,
+                                                  pair_cache_folder)
+    join_oids, join_values = san.arcgis_table_to_arrays(join_features, join_fields)
+    pair_values = join_values[np.searchsorted(join_oids, join_ids)]
+    matched_targets, pair_target = np.unique(target_ids, return_inverse=True)
+    pair_target = pair_target.reshape(-1)
+    order, segment_starts, sorted_values = None, None, None
+    san.arc_print("Computing merge rule statistics...")
+    join_columns = [("JNindex", "<i4", matched_targets),
+                    ("Join_Count", "<i4", np.bincount(pair_target, minlength=len(matched_targets)))]
+    for merge_rule in merge_rule_dict:
+        fields = list(merge_rule_dict[merge_rule])
+        if not fields:
+            continue
+        field_columns = [join_fields.index(field) for field in fields]
+        if str(merge_rule).upper() in san.SCATTER_MERGE_RULES:
+            rule_values = san.scatter_merge_rule(pair_target, pair_values[:, field_columns], len(matched_targets),
+                                                 merge_rule)
+        else:
+            if sorted_values is None:
+                # Pairs are sorted by target and join OID, so segments keep FIRST and LAST in join order
+                order, segment_starts, _ = san.segment_sort(pair_target)
+                sorted_values = pair_values[order]
+            rule_values = san.merge_rule_reduce(sorted_values[:, field_columns], segment_starts, merge_rule)
+        for field, values in zip(fields, rule_values.T):
+            field_name = arcpy.ValidateFieldName(str(merge_rule) + str(prepended_field_name) + str(field),
+                                                 out_workspace)
+            join_columns.append((field_name, merge_rule_dtype(merge_rule, field_types.get(field), values), values))
+    join_array = np.empty(len(matched_targets), dtype=[(name, dtype) for name, dtype, _ in join_columns])
+    # Integer fields cannot hold NaN, so their null statistics are written as 0 and set to null after the join
+    null_targets = {}
+    for name, dtype, values in join_columns:
+        if np.dtype(dtype).kind == "i" and np.isnan(values).any():
+            null_targets[name] = set(matched_targets[np.isnan(values)].tolist())
+            values = np.nan_to_num(values, nan=0.0)
+        join_array[name] = values
+    san.arc_print("Copying target features and extending join fields...")
+    # The copy keeps each target's object ID in TARGET_FID, which links output rows to their statistics
+    field_mappings = arcpy.FieldMappings()
+    field_mappings.addTable(target_feature)
+    target_fid_map = arcpy.FieldMap()
+    target_fid_map.addInputField(target_feature, arcpy.Describe(target_feature).OIDFieldName)
+    out_field = target_fid_map.outputField
+    out_field.name, out_field.aliasName, out_field.type = "TARGET_FID", "TARGET_FID", "Integer"
+    target_fid_map.outputField = out_field
+    field_mappings.addFieldMap(target_fid_map)
+    arcpy.FeatureClassToFeatureClass_conversion(target_feature, out_workspace, os.path.basename(out_feature_class),
+                                                field_mapping=field_mappings)
+    arcpy.da.ExtendTable(out_feature_class, "TARGET_FID", join_array, "JNindex", append_only=False)
+    null_fields = list(null_targets)
+    with arcpy.da.UpdateCursor(out_feature_class, ["TARGET_FID", "Join_Count"] + null_fields) as cursor:
+        for row in cursor:
+            if not row[1]:
+                if not keep_all:
+                    cursor.deleteRow()
+                elif row[1] is None:
+                    cursor.updateRow([row[0], 0] + row[2:])
+            elif any(row[0] in null_targets[field] for field in null_fields):
+                cursor.updateRow(row[:2] + [None if row[0] in null_targets[field] else value
+                                            for field, value in zip(null_fields, row[2:])])
+    return out_feature_class
+
+
 def statistical_spatial_join(target_feature, join_features, out_feature_class, prepended_field_name="",
                              join_operation="JOIN_ONE_TO_ONE", join_type=True, match_option="INTERSECT",
-                             search_radius=None, merge_rule_dict={}):
+                             search_radius=None, merge_rule_dict={}, merge_engine="FIELDMAP",
+                             pair_cache_folder=""):
     """This function will join features to a target feature class using merge fields that are chosen based on the
      chosen summary statistics fields from the join feature class while keeping all the fields in the target.
      Parameters
@@ -71,10 +182,28 @@ def statistical_spatial_join(target_feature, join_features, out_feature_class, p
         See https://pro.arcgis.com/en/pro-app/latest/tool-reference/analysis/spatial-join.htm
      search_radius - Join features within this distance of a target feature will be considered for the spatial join.
      merge_rule_dict - a dictionary of the form {statistic_type:[Fields,To,Summarize]}
+     merge_engine - FIELDMAP aggregates with a field mapping inside SpatialJoin. NUMPY computes the match pairs and
+     evaluates all merge rules as grouped numpy reductions (see merge_rule_spatial_join). NUMPY supports
+     JOIN_ONE_TO_ONE with numeric join fields and falls back to FIELDMAP otherwise.
+     pair_cache_folder - optional folder where the NUMPY engine stores match pairs keyed by the geometry of both
+     inputs, the match option and the search radius, so reruns with new merge rules or attributes skip the overlay.
      """
     try:
         arcpy.env.overwriteOutput = True
         # Start Analysis
+        if str(merge_engine).upper() == "NUMPY":
+            numeric_fields = [field.name for field in arcpy.ListFields(join_features)
+                              if field.type in san.NUMERIC_FIELD_TYPES]
+            rule_fields = [field for fields in merge_rule_dict.values() for field in fields]
+            if join_operation != "JOIN_ONE_TO_ONE":
+                arcpy.AddWarning("The NUMPY merge engine supports JOIN_ONE_TO_ONE only. Using FIELDMAP.")
+            elif not set(rule_fields).issubset(numeric_fields):
+                arcpy.AddWarning("The NUMPY merge engine supports numeric join fields only. Using FIELDMAP.")
+            else:
+                merge_rule_spatial_join(target_feature, join_features, out_feature_class, prepended_field_name,
+                                        join_type, match_option, search_radius, merge_rule_dict, pair_cache_folder)
+                san.arc_print("Script Completed Successfully.", True)
+                return
         san.arc_print("Generating fieldmapping...")
         f_map = san.generate_statistical_fieldmap(target_feature, join_features, prepended_field_name, merge_rule_dict)
         san.arc_print("Conducting spatial join...")
@@ -111,5 +240,8 @@ if __name__ == '__main__':
     for merge_rule, index in zip(merge_rule_identifiers, range(8, 19)):
         merge_rule_dict[merge_rule] = [field for field in arcpy.GetParameterAsText(index).split(";") if
                                        san.field_exist(join_feature_class, field)]
+    merge_engine = arcpy.GetParameterAsText(19) or "FIELDMAP"
+    pair_cache_folder = arcpy.GetParameterAsText(20)
     statistical_spatial_join(target_feature_class, join_feature_class, output_feature_Class, prepended_field_name,
-                             join_operation, join_type, match_option, search_radius, merge_rule_dict)
+                             join_operation, join_type, match_option, search_radius, merge_rule_dict, merge_engine,
+                             pair_cache_folder)
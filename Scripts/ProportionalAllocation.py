@@ -26,6 +26,7 @@
 
 # Import Modules
 import arcpy
+import numpy as np
 import os
 import pandas as pd
 from arcgis.features import GeoAccessor, GeoSeriesAccessor
@@ -33,11 +34,187 @@ from arcgis.features import GeoAccessor, GeoSeriesAccessor
 import SharedArcNumericalLib as san
 
 
+# Overlap measure columns written for each allocation mode (overlap measure, base feature measure)
+MEASURE_COLUMNS = {
+    "AREA": ("inter_area_sqmi", "base_area_sqmi"),
+    "LENGTH": ("inter_length_mi", "base_length_mi"),
+    "COUNT": ("inter_count", "base_count"),
+}
+
+
 # Function Definitions
 
 
+def streaming_allocation_groups(
+    intersect_table,
+    sampling_id,
+    base_fid,
+    base_areas,
+    inter_area_col,
+    base_area_col,
+    sum_fields,
+    mean_fields,
+    chunk_size=1000000,
+    max_memory_groups=5000000,
+    spatial_reference=None,
+):
+    """Reads the intersection table in chunks and accumulates proportional sums and area weighted means by sampling
+    id, so peak memory depends on the number of sampling features rather than the number of intersection rows.
+    Intersection areas are measured from each chunk's geometry and base areas are looked up from the base_areas
+    series (indexed by base object ID) through the base_fid field.
+    Returns a dataframe indexed by sampling id with the area, proportion, SUM_ and MEAN_ columns.
+    """
+    read_fields = [sampling_id, base_fid] + sum_fields + mean_fields
+    sum_start = 2
+    mean_start = sum_start + len(sum_fields)
+
+    def weighted_chunks():
+        for chunk in san.arcgis_table_to_array_chunks(
+            intersect_table,
+            read_fields,
+            chunk_size,
+            measure_unit="SQUARE_MILES",
+            spatial_reference=spatial_reference,
+        ):
+            inter_area = chunk[:, -1]
+            base_area = base_areas.reindex(chunk[:, 1].astype("int64")).to_numpy()
+            proportion = inter_area / np.where(np.isnan(base_area), 1.0, base_area)
+            sums = chunk[:, sum_start:mean_start] * proportion[:, np.newaxis]
+            means = chunk[:, mean_start:-1] * inter_area[:, np.newaxis]
+            yield np.column_stack(
+                [chunk[:, 0], inter_area, base_area, proportion, sums, means]
+            )
+
+    sum_cols = ["SUM_" + str(i) for i in sum_fields]
+    mean_cols = ["MEAN_" + str(i) for i in mean_fields]
+    partition_groups = []
+    # Sums arrive one partition of sampling ids at a time, and only the finished group rows are kept
+    for group_ids, group_sums in san.accumulate_group_sums(
+        weighted_chunks(), max_groups=max_memory_groups
+    ):
+        partition_df = pd.DataFrame(
+            group_sums.reshape(len(group_ids), -1),
+            index=pd.Index(group_ids, name=sampling_id),
+            columns=[inter_area_col, base_area_col, "Proportion"]
+            + sum_cols
+            + mean_cols,
+        )
+        for mean in mean_cols:
+            partition_df[mean] = partition_df[mean] / partition_df[inter_area_col]
+        partition_groups.append(partition_df)
+    inter_groups = pd.concat(partition_groups).sort_index()
+    return inter_groups
+
+
+def allocation_groups(
+    inter_df, sampling_id, inter_measure_col, base_measure_col, sum_fields, mean_fields
+):
+    """Computes proportional sums and weighted means by sampling id from a table with one row per overlap between
+    a sampling and a base feature. The overlap measure (area, length or count) over the base measure is the
+    proportion used for sums, and the overlap measure is the weight used for means.
+    Returns a dataframe indexed by sampling id."""
+    ratio_coverage = "Proportion"
+    inter_df[ratio_coverage] = inter_df[inter_measure_col].fillna(0) / inter_df[
+        base_measure_col
+    ].fillna(1)
+    sum_cols = ["SUM_" + str(i) for i in sum_fields]
+    for input, sum in zip(sum_fields, sum_cols):
+        inter_df[sum] = inter_df[input] * inter_df[ratio_coverage]  # Weight X Value
+    inter_groups_sum = inter_df.groupby(sampling_id).sum()
+    mean_cols = ["MEAN_" + str(i) for i in mean_fields]
+    for input, mean in zip(mean_fields, mean_cols):
+        inter_df[mean] = (
+            inter_df[input] * inter_df[inter_measure_col]
+        )  # (Weight X Value) / SUM(weights)
+    inter_groups_avg = inter_df.groupby(sampling_id).sum()
+    for mean in mean_cols:
+        inter_groups_avg[mean] = (
+            inter_groups_avg[mean] / inter_groups_avg[inter_measure_col]
+        )
+    return inter_groups_sum.merge(
+        inter_groups_avg[mean_cols], how="left", left_index=True, right_index=True
+    )
+
+
+def overlay_allocation_table(
+    sampling_features,
+    base_features,
+    allocation_mode,
+    agg_fields,
+    sampling_id,
+    inter_measure_col,
+    base_measure_col,
+    spatial_reference,
+):
+    """Builds the overlap table for line (LENGTH) or point (COUNT) base features without a polygon overlay. Line
+    lengths inside each sampling polygon come from vectorized segment clipping, and point counts come from a bulk
+    point in polygon test. Multipoint features are weighted by the share of their points in each polygon.
+    Returns a dataframe with the sampling id, overlap measure, base measure and base attribute columns.
+    """
+    samp_oids, samp_coords, samp_offsets, samp_feature = san.arcgis_geometry_to_arrays(
+        sampling_features, spatial_reference=spatial_reference
+    )
+    base_oids, base_coords, base_offsets, base_feature = san.arcgis_geometry_to_arrays(
+        base_features, spatial_reference=spatial_reference
+    )
+    if allocation_mode == "LENGTH":
+        base_index, samp_index, inter_measure = san.line_polygon_overlap_lengths(
+            base_coords,
+            base_offsets,
+            base_feature,
+            samp_coords,
+            samp_offsets,
+            samp_feature,
+            len(samp_oids),
+        )
+        _, base_lengths, _ = san.measure_geometry_arrays(
+            base_coords, base_offsets, base_feature, len(base_oids), "Polyline"
+        )
+        unit_factor = san.geometry_conversion_factor(spatial_reference, "MILES")
+        inter_measure = inter_measure * unit_factor
+        base_measure = base_lengths[base_index] * unit_factor
+    else:
+        vertex_feature = base_feature[san.path_vertex_index(base_offsets)]
+        # Points on a sampling boundary count as inside, within the XY tolerance as in an overlay
+        vertex_index, vertex_samp_index = san.points_in_polygons(
+            base_coords,
+            samp_coords,
+            samp_offsets,
+            samp_feature,
+            len(samp_oids),
+            tolerance=getattr(spatial_reference, "XYTolerance", 0.0),
+        )
+        pair_codes, inter_measure = np.unique(
+            vertex_feature[vertex_index] * len(samp_oids) + vertex_samp_index,
+            return_counts=True,
+        )
+        base_index, samp_index = (
+            pair_codes // len(samp_oids),
+            pair_codes % len(samp_oids),
+        )
+        base_measure = np.bincount(vertex_feature, minlength=len(base_oids))[base_index]
+    inter_df = pd.DataFrame(
+        {
+            sampling_id: samp_oids[samp_index],
+            inter_measure_col: inter_measure.astype("float64"),
+            base_measure_col: base_measure.astype("float64"),
+        }
+    )
+    base_df = san.arcgis_table_to_df(base_features, agg_fields)
+    for field in agg_fields:
+        inter_df[field] = base_df[field].reindex(base_oids[base_index]).to_numpy()
+    return inter_df
+
+
 def proportional_allocation(
-    sampling_features, base_features, out_feature_class, sum_fields=[], mean_fields=[]
+    sampling_features,
+    base_features,
+    out_feature_class,
+    sum_fields=[],
+    mean_fields=[],
+    chunk_size=None,
+    max_memory_groups=5000000,
+    allocation_mode="AUTO",
 ):
     """This script is intended to provide a way to use sampling geography that will calculate proportional
     averages or sums based on the percentage of an intersection covered by the sampling geography. The output is
@@ -52,66 +229,107 @@ def proportional_allocation(
     from the base to the sampling features.
     mean_fields - Fields to proportionally average (based on the overlapping areas between the sampling and base features)
     from the base to the sampling features.
+    chunk_size - If set, the intersection is streamed in chunks of this many rows and aggregated in a bounded
+    memory accumulator instead of being loaded as a single dataframe. Use for very large base layers.
+    max_memory_groups - When streaming, the number of sampling ids held in memory before partial sums are hash
+    partitioned and spilled to disk.
+    allocation_mode - How overlaps are weighted. AREA allocates polygons by intersected area, LENGTH allocates
+    lines by the length inside each sampling polygon, and COUNT allocates points by point in polygon counts. AUTO
+    picks the mode from the base feature shape type. Streaming with chunk_size applies to AREA only.
     """
     arcpy.env.overwriteOutput = True
     # Start Analysis
     temp_intersect = os.path.join("memory", "temp_intersect")
-    san.arc_print("Calculating original areas...")
-    base_area_col = "base_area_sqmi"
-    inter_area_col = "inter_area_sqmi"
-    sampling_id = "sampling_id"
-    ratio_coverage = "Proportion"
-    san.add_new_field(base_features, base_area_col, "DOUBLE")
-    arcpy.CalculateField_management(
-        base_features, base_area_col, "!shape.area@SQUAREMILES!"
-    )
-    san.add_new_field(sampling_features, sampling_id, "LONG")
+    sampling_id = "sampling_id"  # Sampling object IDs, held in memory only
+    allocation_mode = str(allocation_mode).upper()
+    if allocation_mode == "AUTO":
+        shape_type = arcpy.Describe(base_features).shapeType
+        allocation_mode = {
+            "Polyline": "LENGTH",
+            "Point": "COUNT",
+            "Multipoint": "COUNT",
+        }.get(shape_type, "AREA")
+    inter_measure_col, base_measure_col = MEASURE_COLUMNS[allocation_mode]
+    measure_sr = san.get_measure_spatial_reference(sampling_features)
     oid_s = arcpy.Describe(sampling_features).OIDFieldName
-    arcpy.CalculateField_management(
-        sampling_features, sampling_id, "!{0}!".format(oid_s)
-    )
-    san.arc_print("Conducting an intersection...", True)
-    arcpy.Intersect_analysis(
-        [[sampling_features, 1], [base_features, 1]], temp_intersect
-    )
-    san.add_new_field(temp_intersect, inter_area_col, "DOUBLE")
-    arcpy.CalculateField_management(
-        temp_intersect, inter_area_col, "!shape.area@SQUAREMILES!"
-    )
-    san.arc_print("Calculating proportional sums and/or averages...", True)
-    sum_fields = [i for i in sum_fields if san.field_exist(temp_intersect, i)]
-    mean_fields = [i for i in mean_fields if san.field_exist(temp_intersect, i)]
+    if allocation_mode == "AREA":
+        san.arc_print("Calculating original areas...")
+        base_areas = san.arcgis_geometry_measures(
+            base_features, "SQUARE_MILES", spatial_reference=measure_sr
+        )["area"]
+        san.arc_print("Conducting an intersection...", True)
+        arcpy.Intersect_analysis(
+            [[sampling_features, 1], [base_features, 1]], temp_intersect
+        )
+        sampling_fid, base_fid = san.get_intersect_fid_fields(
+            temp_intersect, [sampling_features, base_features]
+        )
+        field_source = temp_intersect
+    else:
+        field_source = base_features
+    sum_fields = [i for i in sum_fields if san.field_exist(field_source, i)]
+    mean_fields = [i for i in mean_fields if san.field_exist(field_source, i)]
     agg_fields = list(set(sum_fields + mean_fields))
     if len(agg_fields) == 0:
         arcpy.AddError("No valid fields to aggregate. Exiting script.")
-    all_fields = [sampling_id, inter_area_col, base_area_col] + agg_fields
-    inter_df = san.arcgis_table_to_df(temp_intersect, all_fields)
-    inter_df[ratio_coverage] = inter_df[inter_area_col].fillna(0) / inter_df[
-        base_area_col
-    ].fillna(1)
-    sum_cols = ["SUM_" + str(i) for i in sum_fields]
-    for input, sum in zip(sum_fields, sum_cols):
-        inter_df[sum] = inter_df[input] * inter_df[ratio_coverage]  # Weight X Value
-    inter_groups_sum = inter_df.groupby(sampling_id).sum()
-    mean_cols = ["MEAN_" + str(i) for i in mean_fields]
-    for input, mean in zip(mean_fields, mean_cols):
-        inter_df[mean] = (
-            inter_df[input] * inter_df[inter_area_col]
-        )  # (Weight X Value) / SUM(weights)
-    inter_groups_avg = inter_df.groupby(sampling_id).sum()
-    for mean in mean_cols:
-        inter_groups_avg[mean] = (
-            inter_groups_avg[mean] / inter_groups_avg[inter_area_col]
+    if allocation_mode != "AREA":
+        san.arc_print(
+            "Computing {0} weighted overlaps...".format(allocation_mode.lower()), True
+        )
+        inter_df = overlay_allocation_table(
+            sampling_features,
+            base_features,
+            allocation_mode,
+            agg_fields,
+            sampling_id,
+            inter_measure_col,
+            base_measure_col,
+            measure_sr,
+        )
+    san.arc_print("Calculating proportional sums and/or averages...", True)
+    if allocation_mode == "AREA" and chunk_size:
+        san.arc_print(
+            "Streaming intersection in chunks of {0} rows...".format(chunk_size)
+        )
+        inter_groups = streaming_allocation_groups(
+            temp_intersect,
+            sampling_fid,
+            base_fid,
+            base_areas,
+            inter_measure_col,
+            base_measure_col,
+            sum_fields,
+            mean_fields,
+            int(chunk_size),
+            int(max_memory_groups),
+            measure_sr,
+        )
+    else:
+        if allocation_mode == "AREA":
+            all_fields = [sampling_fid, base_fid] + agg_fields
+            inter_df = san.arcgis_table_to_df(temp_intersect, all_fields)
+            inter_df = inter_df.rename(columns={sampling_fid: sampling_id})
+            inter_areas = san.arcgis_geometry_measures(
+                temp_intersect, "SQUARE_MILES", spatial_reference=measure_sr
+            )["area"]
+            inter_df[inter_measure_col] = inter_areas.reindex(inter_df.index).to_numpy()
+            inter_df[base_measure_col] = base_areas.reindex(
+                inter_df.pop(base_fid)
+            ).to_numpy()
+        inter_groups = allocation_groups(
+            inter_df,
+            sampling_id,
+            inter_measure_col,
+            base_measure_col,
+            sum_fields,
+            mean_fields,
         )
-    inter_groups = inter_groups_sum.merge(
-        inter_groups_avg[mean_cols], how="left", left_index=True, right_index=True
-    )
     san.arc_print("Associating results to sampled SEDF...")
     samp_df = pd.DataFrame.spatial.from_featureclass(sampling_features)
     samp_df = samp_df.merge(
         inter_groups,
         how="left",
-        left_on=sampling_id,
+        left_on=oid_s,
         right_index=True,
         suffixes=("", "DELETE_Y"),
     )
@@ -139,10 +357,16 @@ if __name__ == "__main__":
     output_feature_class = arcpy.GetParameterAsText(2)
     sum_fields = arcpy.GetParameterAsText(3).split(";")
     mean_fields = arcpy.GetParameterAsText(4).split(";")
+    chunk_size = arcpy.GetParameter(5)
+    max_memory_groups = arcpy.GetParameter(6)
+    allocation_mode = arcpy.GetParameterAsText(7) or "AUTO"
     proportional_allocation(
         target_feature_class,
         join_feature_class,
         output_feature_class,
         sum_fields,
         mean_fields,
+        int(chunk_size) if chunk_size else None,
+        int(max_memory_groups) if max_memory_groups else 5000000,
+        allocation_mode,
     )
@@ -27,6 +27,12 @@ import arcpy
 import numpy as np
 import os, re
 import datetime
+import hashlib
+import itertools
+import multiprocessing
+import shutil
+import sys
+import tempfile
 
 try:
     import pandas as pd
@@ -35,6 +41,15 @@ except:
         "This library requires Pandas installed in the ArcGIS Python Install."
         " Might require installing pre-requisite libraries and software."
     )
+try:
+    from scipy import signal, sparse
+    from scipy.sparse import csgraph
+    from scipy.spatial import cKDTree
+except:
+    arcpy.AddWarning(
+        "The spatial index and kernel density functions in this library require SciPy installed in the ArcGIS "
+        "Python Install."
+    )
 
 
 # Function Definitions
@@ -432,6 +447,2420 @@ def generate_percentile_metric(
     return dataframe
 
 
+###########################
+# Geometry Arrays
+###########################
+
+# Meters per unit for linear units accepted by the geometry measure functions. Area units are the square of a
+# linear unit (SQUARE_MILES, SQUAREMILES) or one of the named area units below.
+LINEAR_UNIT_METERS = {
+    "MILLIMETERS": 0.001,
+    "CENTIMETERS": 0.01,
+    "DECIMETERS": 0.1,
+    "METERS": 1.0,
+    "KILOMETERS": 1000.0,
+    "INCHES": 0.0254,
+    "FEET": 0.3048,
+    "FEETINT": 0.3048,
+    "USSURVEYFEET": 1200.0 / 3937.0,
+    "YARDS": 0.9144,
+    "MILES": 1609.344,
+    "MILESINT": 1609.344,
+    "USSURVEYMILES": 6336000.0 / 3937.0,
+    "NAUTICALMILES": 1852.0,
+}
+AREA_UNIT_SQUARE_METERS = {"ARES": 100.0, "HECTARES": 10000.0, "ACRES": 4046.8564224}
+
+
+def normalize_unit_name(unit):
+    """Returns an upper case unit name with underscores and spaces removed (SQUARE_MILES -> SQUAREMILES)."""
+    return str(unit).upper().replace("_", "").replace(" ", "")
+
+
+def is_area_unit(unit):
+    """Returns true if the passed unit name is an area unit rather than a linear unit."""
+    unit_key = normalize_unit_name(unit)
+    return unit_key.startswith("SQUARE") or unit_key in AREA_UNIT_SQUARE_METERS
+
+
+def geometry_conversion_factor(spatial_reference, unit):
+    """Returns the factor that converts planar measures in the map units of a spatial reference to the passed
+    linear or area unit. Units ending in MAP_UNITS return 1. Unit strings are case and underscore insensitive,
+    so SQUARE_MILES and SquareMiles are equivalent.
+    :param - spatial_reference - arcpy.SpatialReference of the measured coordinates
+    :param - unit - linear unit (MILES, METERS) or area unit (SQUARE_MILES, ACRES)
+    :returns - float conversion factor"""
+    unit_key = normalize_unit_name(unit)
+    if unit_key.endswith("MAPUNITS"):
+        return 1.0
+    meters_per_unit = float(spatial_reference.metersPerUnit)
+    if unit_key in AREA_UNIT_SQUARE_METERS:
+        return meters_per_unit**2 / AREA_UNIT_SQUARE_METERS[unit_key]
+    if unit_key.startswith("SQUARE") and unit_key[6:] in LINEAR_UNIT_METERS:
+        return (meters_per_unit / LINEAR_UNIT_METERS[unit_key[6:]]) ** 2
+    if unit_key in LINEAR_UNIT_METERS:
+        return meters_per_unit / LINEAR_UNIT_METERS[unit_key]
+    raise ValueError(
+        "Unsupported measure unit: {0}. Supported linear units are {1}, area units are SQUARE_ followed by a "
+        "linear unit or one of {2}, and units ending in MAP_UNITS.".format(
+            unit,
+            ", ".join(LINEAR_UNIT_METERS),
+            ", ".join(AREA_UNIT_SQUARE_METERS),
+        )
+    )
+
+
+def get_measure_spatial_reference(in_fc):
+    """Returns the spatial reference planar measures of the input should be computed in. Projected data is
+    measured in its own coordinate system. Geographic data is measured in World Cylindrical Equal Area so areas
+    are not computed in degrees."""
+    spatial_reference = arcpy.Describe(in_fc).spatialReference
+    if spatial_reference.type == "Geographic":
+        arcpy.AddWarning(
+            "{0} has a geographic coordinate system. Measures are computed in World Cylindrical "
+            "Equal Area.".format(os.path.split(str(in_fc))[1])
+        )
+        return arcpy.SpatialReference(54034)
+    return spatial_reference
+
+
+def geometry_to_path_arrays(geometries):
+    """Flattens a sequence of arcpy geometries into contiguous coordinate arrays. Every polygon ring, polyline path
+    and point becomes one path, so multipart features and holes keep their structure without per vertex objects.
+    Null geometries produce no paths.
+    :param - geometries - sequence of arcpy geometry objects (or None)
+    :returns - tuple of (coords, path_offsets, path_feature)
+        coords - (V, 2) float64 vertex coordinates
+        path_offsets - (P + 1,) int64 index of the first vertex of each path in coords
+        path_feature - (P,) int64 position of the geometry each path belongs to"""
+    path_list, feature_list = [], []
+    for position, geometry in enumerate(geometries):
+        if geometry is None:
+            continue
+        geo_interface = geometry.__geo_interface__
+        geo_type = geo_interface["type"]
+        coordinates = geo_interface["coordinates"]
+        if geo_type == "Point":
+            paths = [[coordinates]]
+        elif geo_type in ("MultiPoint", "LineString"):
+            paths = (
+                [coordinates]
+                if geo_type == "LineString"
+                else [[p] for p in coordinates]
+            )
+        elif geo_type in ("MultiLineString", "Polygon"):
+            paths = coordinates
+        else:  # MultiPolygon
+            paths = [ring for polygon in coordinates for ring in polygon]
+        for path in paths:
+            if len(path):
+                path_list.append(np.asarray(path, dtype="float64")[:, :2])
+                feature_list.append(position)
+    if not path_list:
+        return (
+            np.empty((0, 2), dtype="float64"),
+            np.zeros(1, dtype="int64"),
+            np.empty(0, dtype="int64"),
+        )
+    path_lengths = np.array([len(path) for path in path_list], dtype="int64")
+    path_offsets = np.concatenate([[0], np.cumsum(path_lengths)])
+    return (
+        np.concatenate(path_list),
+        path_offsets,
+        np.asarray(feature_list, dtype="int64"),
+    )
+
+
+def arcgis_geometry_to_arrays(in_fc, query="", spatial_reference=None):
+    """Reads the geometry of a feature class in bulk with an arcpy.da.SearchCursor and returns it as contiguous
+    numpy coordinate arrays (see geometry_to_path_arrays).
+    :param - in_fc - input feature class
+    :param - query - sql query to grab appropriate features
+    :param - spatial_reference - optional spatial reference to project coordinates to while reading
+    :returns - tuple of (oids, coords, path_offsets, path_feature) where path_feature indexes oids
+    """
+    oids, geometries = [], []
+    with arcpy.da.SearchCursor(
+        in_fc,
+        ["OID@", "SHAPE@"],
+        where_clause=query,
+        spatial_reference=spatial_reference,
+    ) as cursor:
+        for oid, geometry in cursor:
+            oids.append(oid)
+            geometries.append(geometry)
+    coords, path_offsets, path_feature = geometry_to_path_arrays(geometries)
+    return np.asarray(oids, dtype="int64"), coords, path_offsets, path_feature
+
+
+def path_vertex_index(path_offsets):
+    """Returns the path index of every vertex given path offsets."""
+    path_lengths = np.diff(path_offsets)
+    return np.repeat(np.arange(len(path_lengths)), path_lengths)
+
+
+def path_segments(coords, path_offsets, close_rings=False):
+    """Returns the segments between consecutive vertices of every path. Segments never join two paths. If
+    close_rings is true, a closing segment is added from the last to the first vertex of every path (a zero length
+    segment for rings that are already closed).
+    :returns - tuple of (segment_starts (S, 2), segment_ends (S, 2), segment_path (S,))
+    """
+    vertex_path = path_vertex_index(path_offsets)
+    same_path = vertex_path[:-1] == vertex_path[1:]
+    starts, ends = coords[:-1][same_path], coords[1:][same_path]
+    segment_path = vertex_path[:-1][same_path]
+    if close_rings and len(path_offsets) > 1:
+        first, last = path_offsets[:-1], path_offsets[1:] - 1
+        keep = last > first
+        starts = np.concatenate([starts, coords[last[keep]]])
+        ends = np.concatenate([ends, coords[first[keep]]])
+        segment_path = np.concatenate([segment_path, np.flatnonzero(keep)])
+    return starts, ends, segment_path
+
+
+def measure_geometry_arrays(
+    coords, path_offsets, path_feature, feature_count, shape_type="Polygon"
+):
+    """Computes planar areas, lengths and centroids for flattened geometry arrays with vectorized shoelace and
+    segment math. Areas use signed ring sums so holes are subtracted for either ring orientation convention.
+    Polygon lengths are perimeters. Centroids are area weighted for polygons, length weighted for polylines and
+    vertex means for points. Measures are returned in map units.
+    :param - coords, path_offsets, path_feature - arrays returned by geometry_to_path_arrays
+    :param - feature_count - number of features (length of the returned arrays)
+    :param - shape_type - arcpy shape type of the geometries (Polygon, Polyline, Point, Multipoint)
+    :returns - tuple of areas (F,), lengths (F,) and centroids (F, 2). Empty features have NaN centroids.
+    """
+    feature_count = int(feature_count)
+    is_polygon = str(shape_type) == "Polygon"
+    starts, ends, segment_path = path_segments(coords, path_offsets, is_polygon)
+    segment_feature = path_feature[segment_path]
+    segment_lengths = np.hypot(*(ends - starts).T)
+    lengths = np.bincount(
+        segment_feature, segment_lengths, minlength=feature_count
+    ).astype("float64")
+    areas = np.zeros(feature_count, dtype="float64")
+    centroids = np.full((feature_count, 2), np.nan, dtype="float64")
+    if is_polygon:
+        cross = starts[:, 0] * ends[:, 1] - ends[:, 0] * starts[:, 1]
+        signed_areas = (
+            np.bincount(segment_feature, cross, minlength=feature_count) / 2.0
+        )
+        areas = np.abs(signed_areas)
+        mid_sums = [
+            np.bincount(
+                segment_feature,
+                (starts[:, axis] + ends[:, axis]) * cross,
+                minlength=feature_count,
+            )
+            for axis in (0, 1)
+        ]
+        valid = signed_areas != 0
+        for axis in (0, 1):
+            centroids[valid, axis] = mid_sums[axis][valid] / (6.0 * signed_areas[valid])
+    elif str(shape_type) == "Polyline":
+        midpoints = (starts + ends) / 2.0
+        valid = lengths > 0
+        for axis in (0, 1):
+            weighted = np.bincount(
+                segment_feature, midpoints[:, axis] * segment_lengths, feature_count
+            )
+            centroids[valid, axis] = weighted[valid] / lengths[valid]
+    else:
+        vertex_feature = path_feature[path_vertex_index(path_offsets)]
+        counts = np.bincount(vertex_feature, minlength=feature_count)
+        valid = counts > 0
+        for axis in (0, 1):
+            totals = np.bincount(vertex_feature, coords[:, axis], feature_count)
+            centroids[valid, axis] = totals[valid] / counts[valid]
+    return areas, lengths, centroids
+
+
+def arcgis_geometry_measures(
+    in_fc,
+    area_unit="SQUARE_MILES",
+    length_unit="MILES",
+    query="",
+    spatial_reference=None,
+):
+    """Reads feature geometry in bulk and returns planar areas, lengths and centroids in a dataframe indexed by
+    object ID, without calculating or writing fields on the input. Unit conversion is done with numpy, and
+    centroids are returned in the units of the measure spatial reference.
+    :param - in_fc - input feature class
+    :param - area_unit - area unit for the area column (SQUARE_MILES, ACRES, SQUARE_MAP_UNITS...)
+    :param - length_unit - linear unit for the length column (MILES, METERS, MAP_UNITS...)
+    :param - query - sql query to grab appropriate features
+    :param - spatial_reference - spatial reference to measure in, defaults to get_measure_spatial_reference
+    :returns - pandas.DataFrame with area, length, centroid_x and centroid_y columns"""
+    if spatial_reference is None:
+        spatial_reference = get_measure_spatial_reference(in_fc)
+    shape_type = arcpy.Describe(in_fc).shapeType
+    oids, coords, path_offsets, path_feature = arcgis_geometry_to_arrays(
+        in_fc, query, spatial_reference
+    )
+    areas, lengths, centroids = measure_geometry_arrays(
+        coords, path_offsets, path_feature, len(oids), shape_type
+    )
+    measure_df = pd.DataFrame(
+        {
+            "area": areas * geometry_conversion_factor(spatial_reference, area_unit),
+            "length": lengths
+            * geometry_conversion_factor(spatial_reference, length_unit),
+            "centroid_x": centroids[:, 0],
+            "centroid_y": centroids[:, 1],
+        },
+        index=pd.Index(oids, name=arcpy.Describe(in_fc).OIDFieldName),
+    )
+    return measure_df
+
+
+def sample_path_points(
+    coords, path_offsets, sampling_mode="PERCENTAGE", sample_value=10, max_points=None
+):
+    """Places sample points along every path of flattened polyline arrays by interpolating on cumulative segment
+    length. Every path gets its start and end point.
+    PERCENTAGE - a point every sample_value percent of the path length (as GeneratePointsAlongLines PERCENTAGE).
+    DISTANCE - a point every sample_value map units, so long paths get more points than short ones.
+    COUNT - sample_value points evenly spaced along each path.
+    :param - coords, path_offsets - arrays returned by geometry_to_path_arrays
+    :param - sampling_mode - PERCENTAGE, DISTANCE or COUNT
+    :param - sample_value - percentage, distance or point count for the mode
+    :param - max_points - optional cap on points per path. Paths over the cap get max_points evenly spaced points.
+    :returns - tuple of (xy (N, 2), sample_path (N,)) where sample_path indexes the paths
+    """
+    sampling_mode = str(sampling_mode).upper()
+    path_count = len(path_offsets) - 1
+    starts, ends, segment_path = path_segments(coords, path_offsets)
+    segment_lengths = np.hypot(*(ends - starts).T)
+    segment_counts = np.bincount(segment_path, minlength=path_count)
+    first_segment = np.cumsum(segment_counts) - segment_counts
+    cumulative_ends = np.cumsum(segment_lengths)
+    path_base = np.r_[0.0, cumulative_ends][first_segment]
+    path_lengths = np.bincount(segment_path, segment_lengths, minlength=path_count)
+    sample_value = float(sample_value)
+    if sampling_mode == "COUNT":
+        point_counts = np.full(path_count, max(int(sample_value), 2), dtype="int64")
+        steps = path_lengths / (point_counts - 1)
+    else:
+        steps = (
+            path_lengths * sample_value / 100.0
+            if sampling_mode == "PERCENTAGE"
+            else np.full(path_count, sample_value)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            intervals = np.ceil(path_lengths / steps - 1e-9)
+        point_counts = np.where(path_lengths > 0, intervals + 1, 1).astype("int64")
+    if max_points:
+        max_points = max(int(max_points), 2)
+        over_cap = point_counts > max_points
+        point_counts[over_cap] = max_points
+        steps[over_cap] = path_lengths[over_cap] / (max_points - 1)
+    point_counts[path_lengths <= 0] = 1
+    sample_path, sample_rank = expand_ranges(np.zeros(path_count), point_counts)
+    along = np.minimum(sample_rank * steps[sample_path], path_lengths[sample_path])
+    is_last = sample_rank == point_counts[sample_path] - 1
+    along[is_last] = path_lengths[sample_path][is_last]
+    xy = coords[path_offsets[:-1][sample_path]].copy()
+    has_segments = segment_counts[sample_path] > 0
+    if has_segments.any():
+        target = path_base[sample_path] + along
+        segment = np.clip(
+            np.searchsorted(cumulative_ends, target, side="left"),
+            first_segment[sample_path],
+            first_segment[sample_path] + segment_counts[sample_path] - 1,
+        )[has_segments]
+        lengths = segment_lengths[segment]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(
+                lengths > 0,
+                (target[has_segments] - (cumulative_ends[segment] - lengths)) / lengths,
+                0.0,
+            )
+        ratio = np.clip(ratio, 0.0, 1.0)[:, None]
+        xy[has_segments] = starts[segment] + ratio * (ends[segment] - starts[segment])
+    return xy, sample_path
+
+
+def path_bounding_boxes(coords, path_offsets, path_feature, feature_count):
+    """Returns the bounding box of every feature in flattened geometry arrays as a (F, 4) array of
+    xmin, ymin, xmax, ymax. Features without vertices get NaN boxes."""
+    boxes = np.full((int(feature_count), 4), np.nan, dtype="float64")
+    if len(coords) == 0:
+        return boxes
+    vertex_feature = path_feature[path_vertex_index(path_offsets)]
+    order = np.argsort(vertex_feature, kind="stable")
+    sorted_feature = vertex_feature[order]
+    starts = np.flatnonzero(np.r_[True, sorted_feature[1:] != sorted_feature[:-1]])
+    features = sorted_feature[starts]
+    sorted_coords = coords[order]
+    boxes[features, 0:2] = np.minimum.reduceat(sorted_coords, starts, axis=0)
+    boxes[features, 2:4] = np.maximum.reduceat(sorted_coords, starts, axis=0)
+    return boxes
+
+
+def expand_ranges(starts, counts):
+    """Expands (start, count) ranges into flat arrays. Returns the position of the range each element belongs to
+    and the element values start, start + 1 ... start + count - 1, without a python loop.
+    """
+    counts = np.asarray(counts, dtype="int64")
+    owners = np.repeat(np.arange(len(counts)), counts)
+    range_starts = np.cumsum(counts) - counts
+    values = np.repeat(np.asarray(starts, dtype="int64"), counts) + (
+        np.arange(counts.sum()) - np.repeat(range_starts, counts)
+    )
+    return owners, values
+
+
+def bbox_overlap_pairs(boxes_a, boxes_b, cell_size=None):
+    """Finds every pair of overlapping bounding boxes between two sets with a uniform grid index. Each box is
+    registered in the grid cells it covers, registrations are matched by sorted cell codes, and candidate pairs
+    are filtered by an exact box overlap test. Points can be passed as zero size boxes.
+    :param - boxes_a - (A, 4) array of xmin, ymin, xmax, ymax
+    :param - boxes_b - (B, 4) array of xmin, ymin, xmax, ymax
+    :param - cell_size - grid cell size, defaults to the median size of the larger boxes
+    :returns - tuple of index arrays (a_index, b_index) sorted by a_index"""
+    empty = (np.empty(0, dtype="int64"), np.empty(0, dtype="int64"))
+    valid_a = np.flatnonzero(~np.isnan(boxes_a).any(axis=1))
+    valid_b = np.flatnonzero(~np.isnan(boxes_b).any(axis=1))
+    if len(valid_a) == 0 or len(valid_b) == 0:
+        return empty
+    all_boxes = np.concatenate([boxes_a[valid_a], boxes_b[valid_b]])
+    origin = all_boxes[:, 0:2].min(axis=0)
+    extent = all_boxes[:, 2:4].max(axis=0) - origin
+    if not cell_size:
+        sizes = np.maximum(
+            all_boxes[:, 2] - all_boxes[:, 0], all_boxes[:, 3] - all_boxes[:, 1]
+        )
+        cell_size = max(
+            np.median(sizes[: len(valid_a)]),
+            np.median(sizes[len(valid_a) :]),
+            extent.max() / np.sqrt(len(all_boxes)),
+        )
+    cell_size = max(float(cell_size), 1e-9)
+
+    def register(boxes, index):
+        low = np.floor((boxes[:, 0:2] - origin) / cell_size).astype("int64")
+        high = np.floor((boxes[:, 2:4] - origin) / cell_size).astype("int64")
+        span = high - low + 1
+        owners, cells = expand_ranges(np.zeros(len(boxes)), span[:, 0] * span[:, 1])
+        cell_x = low[owners, 0] + cells % span[owners, 0]
+        cell_y = low[owners, 1] + cells // span[owners, 0]
+        return index[owners], cell_x * (int(extent[1] / cell_size) + 2) + cell_y
+
+    total_cells = np.prod(np.floor(extent / cell_size) + 2)
+    registrations = np.sum(
+        np.prod(
+            np.floor((all_boxes[:, 2:4] - all_boxes[:, 0:2]) / cell_size) + 2, axis=1
+        )
+    )
+    while registrations > 20 * len(all_boxes) + 1000000 and total_cells > 1:
+        cell_size *= 2.0
+        total_cells = np.prod(np.floor(extent / cell_size) + 2)
+        registrations = np.sum(
+            np.prod(
+                np.floor((all_boxes[:, 2:4] - all_boxes[:, 0:2]) / cell_size) + 2,
+                axis=1,
+            )
+        )
+    a_owner, a_cells = register(boxes_a[valid_a], valid_a)
+    b_owner, b_cells = register(boxes_b[valid_b], valid_b)
+    b_order = np.argsort(b_cells, kind="stable")
+    b_owner, b_cells = b_owner[b_order], b_cells[b_order]
+    match_start = np.searchsorted(b_cells, a_cells, side="left")
+    match_count = np.searchsorted(b_cells, a_cells, side="right") - match_start
+    registration, b_position = expand_ranges(match_start, match_count)
+    a_index, b_index = a_owner[registration], b_owner[b_position]
+    box_a, box_b = boxes_a[a_index], boxes_b[b_index]
+    overlap = (
+        (box_a[:, 0] <= box_b[:, 2])
+        & (box_a[:, 2] >= box_b[:, 0])
+        & (box_a[:, 1] <= box_b[:, 3])
+        & (box_a[:, 3] >= box_b[:, 1])
+    )
+    pair_codes = np.unique(a_index[overlap] * len(boxes_b) + b_index[overlap])
+    return pair_codes // len(boxes_b), pair_codes % len(boxes_b)
+
+
+def polygon_edge_arrays(coords, path_offsets, path_feature, feature_count):
+    """Returns the edges of flattened polygon arrays grouped by polygon, including ring closing edges.
+    :returns - tuple of (edge_starts (E, 2), edge_ends (E, 2), edge_offsets (F + 1,)) where the edges of
+        polygon i are edge_offsets[i]:edge_offsets[i + 1]"""
+    starts, ends, segment_path = path_segments(coords, path_offsets, close_rings=True)
+    edge_feature = path_feature[segment_path]
+    order = np.argsort(edge_feature, kind="stable")
+    edge_counts = np.bincount(edge_feature, minlength=int(feature_count))
+    edge_offsets = np.concatenate([[0], np.cumsum(edge_counts)])
+    return starts[order], ends[order], edge_offsets
+
+
+def pair_edge_chunks(pair_polygons, edge_offsets, max_elements=5000000):
+    """Yields (pair_slice, pair_owner, edge_index) chunks that expand (item, polygon) pairs against every edge of
+    the pair's polygon. Chunks hold at most about max_elements pair-edge elements to bound memory.
+    """
+    edge_counts = edge_offsets[pair_polygons + 1] - edge_offsets[pair_polygons]
+    cumulative = np.cumsum(edge_counts)
+    start = 0
+    while start < len(pair_polygons):
+        base = cumulative[start - 1] if start else 0
+        stop = int(np.searchsorted(cumulative, base + max_elements, side="right"))
+        stop = max(stop, start + 1)
+        pair_slice = slice(start, stop)
+        pair_owner, edge_index = expand_ranges(
+            edge_offsets[pair_polygons[pair_slice]], edge_counts[pair_slice]
+        )
+        yield pair_slice, pair_owner, edge_index
+        start = stop
+
+
+def crossing_parity(points, edge_starts, edge_ends):
+    """Returns true where a horizontal ray cast from each point crosses the paired edge (even-odd rule)."""
+    y1, y2 = edge_starts[:, 1], edge_ends[:, 1]
+    straddles = (y1 > points[:, 1]) != (y2 > points[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_cross = edge_starts[:, 0] + (points[:, 1] - y1) * (
+            edge_ends[:, 0] - edge_starts[:, 0]
+        ) / (y2 - y1)
+    return straddles & (points[:, 0] < x_cross)
+
+
+def points_in_polygons(
+    point_xy,
+    coords,
+    path_offsets,
+    path_feature,
+    feature_count,
+    max_elements=5000000,
+    tolerance=0.0,
+):
+    """Bulk point in polygon test. Candidate (point, polygon) pairs come from a grid index over the polygon
+    bounding boxes, and every candidate is tested against all edges of its polygon in vectorized batches with
+    the even-odd rule, so holes and multipart polygons are handled. Points within the tolerance of a polygon's
+    edges also match, as points on the boundary intersect the polygon.
+    :param - point_xy - (N, 2) point coordinates
+    :param - coords, path_offsets, path_feature - flattened polygon arrays (see geometry_to_path_arrays)
+    :param - feature_count - number of polygons
+    :param - max_elements - maximum pair-edge elements evaluated at once
+    :param - tolerance - distance to an edge in map units within which points match, such as the XY tolerance
+    :returns - tuple of (point_index, polygon_index) for every point inside or on a polygon
+    """
+    point_xy = np.asarray(point_xy, dtype="float64").reshape(-1, 2)
+    tolerance = float(tolerance or 0.0)
+    poly_boxes = path_bounding_boxes(coords, path_offsets, path_feature, feature_count)
+    point_boxes = np.column_stack([point_xy - tolerance, point_xy + tolerance])
+    point_index, polygon_index = bbox_overlap_pairs(point_boxes, poly_boxes)
+    edge_starts, edge_ends, edge_offsets = polygon_edge_arrays(
+        coords, path_offsets, path_feature, feature_count
+    )
+    inside = np.zeros(len(point_index), dtype=bool)
+    for pair_slice, pair_owner, edge_index in pair_edge_chunks(
+        polygon_index, edge_offsets, max_elements
+    ):
+        pair_points = point_xy[point_index[pair_slice]][pair_owner]
+        q0, q1 = edge_starts[edge_index], edge_ends[edge_index]
+        pair_count = pair_slice.stop - pair_slice.start
+        counts = np.bincount(
+            pair_owner, crossing_parity(pair_points, q0, q1), minlength=pair_count
+        )
+        inside[pair_slice] = counts % 2 == 1
+        if tolerance > 0:
+            # Squared distance from each point to the nearest point of each edge
+            e = q1 - q0
+            offset = pair_points - q0
+            edge_length = np.einsum("ij,ij->i", e, e)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = np.einsum("ij,ij->i", offset, e) / edge_length
+            t = np.clip(np.nan_to_num(t, nan=0.0), 0.0, 1.0)
+            gap = offset - t[:, None] * e
+            near_edge = np.einsum("ij,ij->i", gap, gap) <= tolerance**2
+            inside[pair_slice] |= (
+                np.bincount(pair_owner, near_edge, minlength=pair_count) > 0
+            )
+    return point_index[inside], polygon_index[inside]
+
+
+def clip_segments_to_polygons(
+    segment_starts,
+    segment_ends,
+    coords,
+    path_offsets,
+    path_feature,
+    feature_count,
+    max_elements=5000000,
+):
+    """Computes the length of every segment inside every polygon it overlaps with vectorized clipping. Each
+    candidate (segment, polygon) pair from the grid index is intersected with all edges of the polygon. The
+    crossing parameters are sorted along the segment, and the inside state starts from an even-odd test of the
+    segment start and flips at every crossing.
+    :param - segment_starts, segment_ends - (S, 2) segment end points
+    :param - coords, path_offsets, path_feature - flattened polygon arrays (see geometry_to_path_arrays)
+    :param - feature_count - number of polygons
+    :param - max_elements - maximum pair-edge elements evaluated at once
+    :returns - tuple of (segment_index, polygon_index, inside_length) for pairs with a positive inside length
+    """
+    segment_boxes = np.column_stack(
+        [
+            np.minimum(segment_starts, segment_ends),
+            np.maximum(segment_starts, segment_ends),
+        ]
+    )
+    poly_boxes = path_bounding_boxes(coords, path_offsets, path_feature, feature_count)
+    segment_index, polygon_index = bbox_overlap_pairs(segment_boxes, poly_boxes)
+    edge_starts, edge_ends, edge_offsets = polygon_edge_arrays(
+        coords, path_offsets, path_feature, feature_count
+    )
+    inside_fraction = np.zeros(len(segment_index), dtype="float64")
+    for pair_slice, pair_owner, edge_index in pair_edge_chunks(
+        polygon_index, edge_offsets, max_elements
+    ):
+        pair_count = pair_slice.stop - pair_slice.start
+        p0 = segment_starts[segment_index[pair_slice]][pair_owner]
+        d = segment_ends[segment_index[pair_slice]][pair_owner] - p0
+        q0, q1 = edge_starts[edge_index], edge_ends[edge_index]
+        e = q1 - q0
+        start_crossings = np.bincount(
+            pair_owner, crossing_parity(p0, q0, q1), minlength=pair_count
+        )
+        start_inside = start_crossings % 2 == 1
+        denom = d[:, 0] * e[:, 1] - d[:, 1] * e[:, 0]
+        offset = q0 - p0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = (offset[:, 0] * e[:, 1] - offset[:, 1] * e[:, 0]) / denom
+            u = (offset[:, 0] * d[:, 1] - offset[:, 1] * d[:, 0]) / denom
+        crosses = (denom != 0) & (t > 0) & (t < 1) & (u >= 0) & (u < 1)
+        cross_owner, cross_t = pair_owner[crosses], t[crosses]
+        order = np.lexsort((cross_t, cross_owner))
+        cross_owner, cross_t = cross_owner[order], cross_t[order]
+        first = np.r_[True, cross_owner[1:] != cross_owner[:-1]]
+        group_start = np.maximum.accumulate(np.where(first, np.arange(len(first)), 0))
+        rank = np.arange(len(cross_owner)) - group_start
+        previous_t = np.where(first, 0.0, np.r_[0.0, cross_t[:-1]])
+        inside_before = start_inside[cross_owner] ^ (rank % 2 == 1)
+        fraction = np.bincount(
+            cross_owner,
+            np.where(inside_before, cross_t - previous_t, 0.0),
+            minlength=pair_count,
+        )
+        crossing_count = np.bincount(cross_owner, minlength=pair_count)
+        last_t = np.zeros(pair_count, dtype="float64")
+        last = np.r_[cross_owner[1:] != cross_owner[:-1], True][: len(cross_owner)]
+        last_t[cross_owner[last]] = cross_t[last]
+        inside_after = start_inside ^ (crossing_count % 2 == 1)
+        fraction += np.where(inside_after, 1.0 - last_t, 0.0)
+        inside_fraction[pair_slice] = fraction
+    lengths = inside_fraction * np.hypot(
+        *(segment_ends[segment_index] - segment_starts[segment_index]).T
+    )
+    keep = lengths > 0
+    return segment_index[keep], polygon_index[keep], lengths[keep]
+
+
+def line_polygon_overlap_lengths(
+    line_coords,
+    line_offsets,
+    line_path_feature,
+    coords,
+    path_offsets,
+    path_feature,
+    feature_count,
+):
+    """Returns the length of every polyline inside every polygon it overlaps, summed over the line's segments
+    (see clip_segments_to_polygons).
+    :returns - tuple of (line_index, polygon_index, inside_length)"""
+    starts, ends, segment_path = path_segments(line_coords, line_offsets)
+    segment_index, polygon_index, lengths = clip_segments_to_polygons(
+        starts, ends, coords, path_offsets, path_feature, feature_count
+    )
+    line_index = line_path_feature[segment_path[segment_index]]
+    pair_codes, inverse = np.unique(
+        line_index * int(feature_count) + polygon_index, return_inverse=True
+    )
+    pair_lengths = np.bincount(inverse, lengths, minlength=len(pair_codes))
+    return (
+        pair_codes // int(feature_count),
+        pair_codes % int(feature_count),
+        pair_lengths,
+    )
+
+
+def get_intersect_fid_fields(intersect_fc, in_features):
+    """Returns the FID_ fields Intersect writes to its output for each of the passed input features, in the same
+    order as the inputs. These hold the object IDs of the input features each output feature came from.
+    :param - intersect_fc - output of arcpy.Intersect_analysis run with join_attributes ALL or ONLY_FID
+    :param - in_features - list of the input features in the order they were passed to Intersect
+    :returns - list of field names"""
+    fid_fields = [
+        f.name
+        for f in arcpy.ListFields(intersect_fc)
+        if f.name.upper().startswith("FID_")
+    ]
+    workspace = os.path.dirname(arcpy.Describe(intersect_fc).catalogPath)
+    matched_fields, expected_counts = [], {}
+    for index, in_feature in enumerate(in_features):
+        expected = arcpy.ValidateFieldName(
+            "FID_{0}".format(arcpy.Describe(in_feature).baseName), workspace
+        )
+        # Inputs with the same base name get FID_name, FID_name_1, ... in input order
+        repeat = expected_counts.get(expected.upper(), 0)
+        expected_counts[expected.upper()] = repeat + 1
+        if repeat:
+            expected = "{0}_{1}".format(expected, repeat)
+        matches = [
+            f
+            for f in fid_fields
+            if f.upper() == expected.upper() and f not in matched_fields
+        ]
+        if matches:
+            matched_fields.append(matches[0])
+        elif len(fid_fields) == len(in_features):
+            matched_fields.append(fid_fields[index])
+        else:
+            raise ValueError(
+                "Could not identify the Intersect FID field for {0}.".format(in_feature)
+            )
+    if len(set(matched_fields)) != len(matched_fields):
+        raise ValueError(
+            "Intersect FID fields {0} do not identify every input.".format(
+                matched_fields
+            )
+        )
+    return matched_fields
+
+
+###########################
+# Chunked Aggregation
+###########################
+
+
+def arcgis_table_to_array_chunks(
+    in_table,
+    input_fields,
+    chunk_size=1000000,
+    query="",
+    measure_unit=None,
+    spatial_reference=None,
+):
+    """Generator that reads an arcgis table with an arcpy.da.SearchCursor and yields 2-D float64 numpy arrays of
+    at most chunk_size rows, so tables that are too large to load at once can be processed in bounded memory.
+    Null values are returned as NaN.
+    :param - in_table - input feature class or table to read
+    :param - input_fields - numeric fields to read, columns are returned in the same order
+    :param - chunk_size - maximum number of rows held in each yielded array
+    :param - query - sql query to grab appropriate values
+    :param - measure_unit - if set, the planar area (area units) or length (linear units) of each feature is
+        computed from its coordinates with measure_geometry_arrays and appended as the last column
+    :param - spatial_reference - spatial reference features are measured in when measure_unit is set
+    :returns - generator of numpy.ndarray of shape (rows, len(input_fields)) (plus one column if measured)
+    """
+    chunk_size = max(int(chunk_size), 1)
+    cursor_fields = list(input_fields)
+    if measure_unit:
+        describe = arcpy.Describe(in_table)
+        if spatial_reference is None:
+            spatial_reference = get_measure_spatial_reference(in_table)
+        unit_factor = geometry_conversion_factor(spatial_reference, measure_unit)
+        is_area = is_area_unit(measure_unit)
+        cursor_fields = cursor_fields + ["SHAPE@"]
+    with arcpy.da.SearchCursor(
+        in_table, cursor_fields, where_clause=query, spatial_reference=spatial_reference
+    ) as cursor:
+        while True:
+            rows = list(itertools.islice(cursor, chunk_size))
+            if not rows:
+                break
+            if not measure_unit:
+                yield np.array(rows, dtype="float64").reshape(
+                    len(rows), len(input_fields)
+                )
+                continue
+            values = np.array([row[:-1] for row in rows], dtype="float64")
+            areas, lengths, _ = measure_geometry_arrays(
+                *geometry_to_path_arrays([row[-1] for row in rows]),
+                feature_count=len(rows),
+                shape_type=describe.shapeType,
+            )
+            measures = (areas if is_area else lengths) * unit_factor
+            yield np.column_stack(
+                [values.reshape(len(rows), len(input_fields)), measures]
+            )
+
+
+def reduce_group_sums(group_ids, values):
+    """Sums the rows of a 2-D value array by an integer group id array. NaN values are treated as 0 (consistent
+    with pandas sums).
+    :param - group_ids - 1-D integer array of group ids, one per row of values
+    :param - values - 2-D float array of values to sum by group
+    :returns - tuple of sorted unique group ids and a 2-D array of group sums"""
+    unique_ids, inverse = np.unique(group_ids, return_inverse=True)
+    values = np.nan_to_num(values, nan=0.0)
+    sums = np.empty((len(unique_ids), values.shape[1]), dtype="float64")
+    for col in range(values.shape[1]):
+        sums[:, col] = np.bincount(
+            inverse, weights=values[:, col], minlength=len(unique_ids)
+        )
+    return unique_ids, sums
+
+
+def merge_group_sums(group_ids, sums, new_group_ids, new_sums):
+    """Merges partial group sums into an existing sorted accumulator. Both id arrays must be sorted and unique.
+    Existing groups are added to in place, and unseen groups are inserted in sorted order.
+    :returns - tuple of the merged sorted group ids and group sums"""
+    if len(group_ids) == 0:
+        return new_group_ids, new_sums
+    positions = np.searchsorted(group_ids, new_group_ids)
+    clipped = np.minimum(positions, len(group_ids) - 1)
+    found = group_ids[clipped] == new_group_ids
+    sums[clipped[found]] += new_sums[found]
+    if found.all():
+        return group_ids, sums
+    group_ids = np.concatenate([group_ids, new_group_ids[~found]])
+    sums = np.concatenate([sums, new_sums[~found]])
+    order = np.argsort(group_ids, kind="stable")
+    return group_ids[order], sums[order]
+
+
+def accumulate_group_sums(
+    chunks, group_column=0, max_groups=5000000, partitions=64, spill_folder=None
+):
+    """Streams 2-D array chunks into per group sums held in a sorted array-backed accumulator, and yields the
+    sums one partition of groups at a time. One column of each chunk holds integer group ids and every other column
+    is summed by group. If more than max_groups distinct groups are held in memory, the accumulator and all
+    remaining partial sums are hash partitioned by group id and spilled to binary files. Each partition is then
+    reduced and yielded separately once the chunks are consumed, so peak memory is set by the groups of one
+    partition rather than all groups or the number of rows streamed. Spilled group ids are kept as int64.
+    :param - chunks - iterable of 2-D float arrays (for example from arcgis_table_to_array_chunks)
+    :param - group_column - index of the column holding group ids
+    :param - max_groups - number of groups held in memory before spilling to disk
+    :param - partitions - number of hash partitions used when spilling
+    :param - spill_folder - folder for spill files, defaults to the system temporary folder
+    :returns - generator of (sorted unique group ids (int64), 2-D array of sums for the remaining columns) tuples,
+        one per partition. Every group is in exactly one partition.
+    """
+    group_ids, sums = np.empty(0, dtype="int64"), None
+    spill_dir, spill_files, record_dtype = None, [], None
+    try:
+        for chunk in chunks:
+            chunk_ids = chunk[:, group_column].astype("int64")
+            chunk_values = np.delete(chunk, group_column, axis=1)
+            chunk_ids, chunk_sums = reduce_group_sums(chunk_ids, chunk_values)
+            sums_width = chunk_sums.shape[1]
+            if spill_dir is None:
+                if sums is None:
+                    sums = np.empty((0, sums_width), dtype="float64")
+                group_ids, sums = merge_group_sums(
+                    group_ids, sums, chunk_ids, chunk_sums
+                )
+                if len(group_ids) <= max_groups:
+                    continue
+                arc_print(
+                    "Group count exceeded {0}, spilling partial sums to disk...".format(
+                        max_groups
+                    )
+                )
+                spill_dir = tempfile.mkdtemp(prefix="san_spill_", dir=spill_folder)
+                spill_files = [
+                    os.path.join(spill_dir, "part_{0}.bin".format(i))
+                    for i in range(partitions)
+                ]
+                # Group ids are stored as int64 next to their sums so large ids keep full precision
+                record_dtype = np.dtype(
+                    [("group_id", "<i8"), ("sums", "<f8", (sums_width,))]
+                )
+                chunk_ids, chunk_sums = group_ids, sums
+                group_ids, sums = np.empty(0, dtype="int64"), None
+            partition_index = chunk_ids % partitions
+            records = np.empty(len(chunk_ids), dtype=record_dtype)
+            records["group_id"], records["sums"] = chunk_ids, chunk_sums
+            for part in np.unique(partition_index):
+                with open(spill_files[part], "ab") as spill_file:
+                    records[partition_index == part].tofile(spill_file)
+        if spill_dir is None:
+            if sums is None:
+                sums = np.empty((0, 0), dtype="float64")
+            yield group_ids, sums
+            return
+        for spill_file in spill_files:
+            if not os.path.exists(spill_file):
+                continue
+            records = np.fromfile(spill_file, dtype=record_dtype)
+            yield reduce_group_sums(
+                records["group_id"], records["sums"].reshape(len(records), -1)
+            )
+    finally:
+        if spill_dir is not None:
+            shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+###########################
+# Kernel Density
+###########################
+
+
+def arcgis_points_to_arrays(in_fc, value_fields=[], query="", spatial_reference=None):
+    """Reads point locations and numeric attributes in bulk with an arcpy.da.SearchCursor. Multipart features
+    are located at their centroid. Null values are returned as NaN.
+    :param - in_fc - input point feature class
+    :param - value_fields - numeric fields to return as value columns
+    :param - query - sql query to grab appropriate features
+    :param - spatial_reference - optional spatial reference to project coordinates to while reading
+    :returns - tuple of (oids (N,), xy (N, 2), values (N, len(value_fields)))"""
+    cursor_fields = ["OID@", "SHAPE@X", "SHAPE@Y"] + list(value_fields)
+    with arcpy.da.SearchCursor(
+        in_fc, cursor_fields, where_clause=query, spatial_reference=spatial_reference
+    ) as cursor:
+        rows = np.array([row for row in cursor], dtype="float64").reshape(
+            -1, len(cursor_fields)
+        )
+    return rows[:, 0].astype("int64"), rows[:, 1:3], rows[:, 3:]
+
+
+def quartic_kernel(distances, search_radius):
+    """Returns the quartic kernel used by the ArcGIS Kernel Density tool (Silverman, 1986) for each distance:
+    3 / pi * (1 - (d / r) ^ 2) ^ 2 / r ^ 2, and 0 at or beyond the search radius. Integrates to 1 over the
+    plane, so weighted sums give densities per square map unit."""
+    search_radius = float(search_radius)
+    scaled = 1.0 - (np.asarray(distances, dtype="float64") / search_radius) ** 2
+    return np.where(scaled > 0, 3.0 / np.pi * scaled**2 / search_radius**2, 0.0)
+
+
+def kernel_density_at_points(
+    point_xy,
+    point_weights,
+    sample_xy,
+    search_radius,
+    area_factor=1.0,
+    chunk_size=250000,
+):
+    """Evaluates a planar quartic kernel density for many weight fields directly at sample locations, without
+    building a density raster. A KD-tree over the input points finds every (sample, point) pair within the search
+    radius once, and the densities for all fields come from one sparse kernel weight matrix times the field
+    matrix. Samples are processed in chunks to bound the number of pairs held in memory.
+    :param - point_xy - (N, 2) input point coordinates
+    :param - point_weights - (N, F) weight (population) matrix, NaN weights count as 0
+    :param - sample_xy - (S, 2) locations to evaluate the densities at
+    :param - search_radius - kernel bandwidth in map units, or a list of bandwidths. Neighbors are found once at
+        the largest bandwidth and every bandwidth is evaluated from the same distance sorted pairs.
+    :param - area_factor - multiplier converting densities per square map unit to the output area unit
+    :param - chunk_size - number of samples evaluated per KD-tree query
+    :returns - (S, F) float64 density matrix, or (R, S, F) for a list of R bandwidths"""
+    point_xy = np.asarray(point_xy, dtype="float64").reshape(-1, 2)
+    sample_xy = np.asarray(sample_xy, dtype="float64").reshape(-1, 2)
+    point_weights = np.nan_to_num(
+        np.asarray(point_weights, dtype="float64").reshape(len(point_xy), -1), nan=0.0
+    )
+    search_radii = np.atleast_1d(np.asarray(search_radius, dtype="float64"))
+    densities = np.zeros(
+        (len(search_radii), len(sample_xy), point_weights.shape[1]), dtype="float64"
+    )
+    if len(point_xy) and len(sample_xy):
+        point_tree = cKDTree(point_xy)
+        for start in range(0, len(sample_xy), int(chunk_size)):
+            chunk = sample_xy[start : start + int(chunk_size)]
+            pairs = cKDTree(chunk).sparse_distance_matrix(
+                point_tree, search_radii.max(), output_type="ndarray"
+            )
+            pairs = pairs[np.argsort(pairs["v"], kind="stable")]
+            for radius_index, radius in enumerate(search_radii):
+                # Pairs are sorted by distance, so each radius uses a prefix of them
+                nearby = pairs[: np.searchsorted(pairs["v"], radius, side="left")]
+                kernel_weights = sparse.csr_matrix(
+                    (quartic_kernel(nearby["v"], radius), (nearby["i"], nearby["j"])),
+                    shape=(len(chunk), len(point_xy)),
+                )
+                densities[radius_index, start : start + len(chunk)] = (
+                    kernel_weights @ point_weights
+                )
+    densities *= float(area_factor)
+    return densities if np.ndim(search_radius) else densities[0]
+
+
+def network_graph_arrays(coords, path_offsets, max_edge_length=None, tolerance=0.001):
+    """Builds an undirected sparse graph from flattened polyline arrays. Segments are split into equal edges no
+    longer than max_edge_length, and vertices closer than tolerance share a node, so lines that meet at shared
+    endpoints are connected. Overlapping duplicate edges keep their shortest length.
+    :param - coords, path_offsets - arrays returned by geometry_to_path_arrays
+    :param - max_edge_length - optional longest edge in map units (the KDE cell size)
+    :param - tolerance - node snapping tolerance in map units
+    :returns - tuple of (node_xy (V, 2), graph) where graph is a (V, V) scipy csr matrix of edge lengths
+    """
+    starts, ends, _ = path_segments(coords, path_offsets)
+    segment_lengths = np.hypot(*(ends - starts).T)
+    pieces = np.ones(len(starts), dtype="int64")
+    if max_edge_length:
+        pieces = np.maximum(
+            np.ceil(segment_lengths / float(max_edge_length)).astype("int64"), 1
+        )
+    segment, step = expand_ranges(np.zeros(len(starts)), pieces + 1)
+    ratio = (step / pieces[segment])[:, None]
+    points = starts[segment] + ratio * (ends[segment] - starts[segment])
+    node_keys = np.round(points / float(tolerance)).astype("int64")
+    node_keys, first_point, point_node = np.unique(
+        node_keys, axis=0, return_index=True, return_inverse=True
+    )
+    point_node = point_node.reshape(-1)
+    node_xy = points[first_point]
+    edge_end = np.flatnonzero(step > 0)
+    edge_a = np.minimum(point_node[edge_end - 1], point_node[edge_end])
+    edge_b = np.maximum(point_node[edge_end - 1], point_node[edge_end])
+    edge_lengths = (segment_lengths / pieces)[segment[edge_end]]
+    keep = edge_a != edge_b
+    edge_a, edge_b, edge_lengths = edge_a[keep], edge_b[keep], edge_lengths[keep]
+    order = np.lexsort((edge_lengths, edge_b, edge_a))
+    edge_a, edge_b, edge_lengths = edge_a[order], edge_b[order], edge_lengths[order]
+    first = np.r_[True, (edge_a[1:] != edge_a[:-1]) | (edge_b[1:] != edge_b[:-1])]
+    graph = sparse.csr_matrix(
+        (edge_lengths[first], (edge_a[first], edge_b[first])),
+        shape=(len(node_xy), len(node_xy)),
+    )
+    return node_xy, graph
+
+
+def network_kernel_batch(
+    graph, source_nodes, source_weights, target_nodes, search_radius
+):
+    """Runs cutoff bounded shortest paths from a batch of source nodes and sums their weighted quartic kernels at
+    the target nodes for every search radius. The search runs once, bounded by the largest radius.
+    :returns - (R, T, F) kernel weighted sums for the batch"""
+    search_radii = np.atleast_1d(np.asarray(search_radius, dtype="float64"))
+    distances = csgraph.dijkstra(
+        graph, directed=False, indices=source_nodes, limit=search_radii.max()
+    )[:, target_nodes]
+    return np.stack(
+        [
+            quartic_kernel(distances, radius).T @ source_weights
+            for radius in search_radii
+        ]
+    )
+
+
+def network_kernel_density(
+    node_xy,
+    graph,
+    point_xy,
+    point_weights,
+    sample_xy,
+    search_radius,
+    area_factor=1.0,
+    workers=1,
+    max_elements=20000000,
+    max_snap_distance=None,
+):
+    """Evaluates a quartic kernel density measured with network distances instead of straight lines. Input points
+    and sample locations are snapped to their nearest graph node, weights are summed per source node, and
+    multi-source Dijkstra searches bounded by the search radius run over batches of source nodes (in a process pool
+    when workers > 1). The kernel is the planar quartic kernel of quartic_kernel evaluated at network distance, so
+    densities keep the units of the other engines and match them where the network is straight.
+    :param - node_xy, graph - arrays returned by network_graph_arrays
+    :param - point_xy - (N, 2) input point coordinates
+    :param - point_weights - (N, F) weight matrix, NaN weights count as 0
+    :param - sample_xy - (S, 2) locations to evaluate the densities at
+    :param - search_radius - kernel bandwidth in network map units, or a list of bandwidths sharing one search
+    :param - area_factor - multiplier converting densities per square map unit to the output area unit
+    :param - workers - worker count passed to process_pool_map
+    :param - max_elements - largest distance matrix (sources by nodes) computed per batch
+    :param - max_snap_distance - input points farther than this from every graph node are dropped with a warning,
+    defaults to the largest search radius
+    :returns - (S, F) float64 density matrix, or (R, S, F) for a list of R bandwidths"""
+    point_xy = np.asarray(point_xy, dtype="float64").reshape(-1, 2)
+    point_weights = np.nan_to_num(
+        np.asarray(point_weights, dtype="float64").reshape(len(point_xy), -1), nan=0.0
+    )
+    search_radii = np.atleast_1d(np.asarray(search_radius, dtype="float64"))
+    densities = np.zeros(
+        (len(search_radii), len(sample_xy), point_weights.shape[1]), dtype="float64"
+    )
+    if len(point_xy) == 0 or len(sample_xy) == 0 or len(node_xy) == 0:
+        return densities if np.ndim(search_radius) else densities[0]
+    node_tree = cKDTree(node_xy)
+    if max_snap_distance is None:
+        max_snap_distance = search_radii.max()
+    snap_distances, snap_nodes = node_tree.query(
+        point_xy, distance_upper_bound=float(max_snap_distance)
+    )
+    snapped = np.isfinite(snap_distances)
+    if not snapped.all():
+        arcpy.AddWarning(
+            "Dropped {0} input points farther than {1} from the network.".format(
+                int((~snapped).sum()), max_snap_distance
+            )
+        )
+        if not snapped.any():
+            return densities if np.ndim(search_radius) else densities[0]
+    order, segment_starts, source_nodes = segment_sort(snap_nodes[snapped])
+    source_weights = segment_reduce(
+        point_weights[snapped], order, segment_starts, "sum"
+    )
+    target_nodes, sample_target = np.unique(
+        node_tree.query(sample_xy)[1], return_inverse=True
+    )
+    batch_size = max(1, int(max_elements) // len(node_xy))
+    batch_arguments = [
+        (
+            graph,
+            source_nodes[start : start + batch_size],
+            source_weights[start : start + batch_size],
+            target_nodes,
+            search_radii,
+        )
+        for start in range(0, len(source_nodes), batch_size)
+    ]
+    target_densities = np.zeros(
+        (len(search_radii), len(target_nodes), point_weights.shape[1]), dtype="float64"
+    )
+    for batch_densities in process_pool_map(
+        network_kernel_batch, batch_arguments, workers
+    ):
+        target_densities += batch_densities
+    densities[:] = target_densities[:, sample_target.reshape(-1)] * area_factor
+    return densities if np.ndim(search_radius) else densities[0]
+
+
+def raster_grid(extent, cell_size):
+    """Returns a raster grid definition (x_min, y_min, cell_size, n_rows, n_cols) covering an extent. The grid
+    is anchored at the lower left corner of the extent, row 0 is the northern row (the ArcGIS and
+    RasterToNumPyArray convention), and cell (r, c) is centered at
+    (x_min + (c + 0.5) * cell_size, y_min + (n_rows - r - 0.5) * cell_size).
+    :param - extent - arcpy.Extent or (x_min, y_min, x_max, y_max)
+    :param - cell_size - cell size in map units"""
+    if hasattr(extent, "XMin"):
+        extent = (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+    x_min, y_min, x_max, y_max = [float(i) for i in extent]
+    cell_size = float(cell_size)
+    n_cols = max(int(np.ceil((x_max - x_min) / cell_size)), 1)
+    n_rows = max(int(np.ceil((y_max - y_min) / cell_size)), 1)
+    return x_min, y_min, cell_size, n_rows, n_cols
+
+
+def quartic_kernel_stencil(search_radius, cell_size):
+    """Returns the quartic kernel (see quartic_kernel) evaluated at the cell center offsets of a square stencil
+    wide enough to hold the search radius."""
+    half_width = int(np.ceil(float(search_radius) / float(cell_size)))
+    offsets = np.arange(-half_width, half_width + 1) * float(cell_size)
+    return quartic_kernel(np.hypot(*np.meshgrid(offsets, offsets)), search_radius)
+
+
+def fft_kernel_density(
+    point_xy,
+    point_weights,
+    grid,
+    search_radius,
+    area_factor=1.0,
+    out=None,
+    max_batch_cells=200000000,
+):
+    """Computes kernel density surfaces for many weight fields at once. All fields are binned onto one shared
+    grid as a stacked (fields, rows, cols) array with a single bincount, and the stack is convolved with the
+    quartic kernel stencil by FFT in one batched call. The grid is padded by the search radius while binning so
+    points outside the grid still contribute to cells near its edge. Point locations are snapped to cell centers,
+    so results match the point to cell distance of the Kernel Density tool within the cell size.
+    :param - point_xy - (N, 2) input point coordinates
+    :param - point_weights - (N, F) weight matrix, NaN weights count as 0
+    :param - grid - grid definition from raster_grid
+    :param - search_radius - kernel bandwidth in map units
+    :param - area_factor - multiplier converting densities per square map unit to the output area unit
+    :param - out - optional (F, rows, cols) array (for example a memory-mapped raster) to write surfaces into
+    :param - max_batch_cells - maximum padded cells convolved at once, fields are batched to stay below it
+    :returns - (F, rows, cols) density array (out if passed)"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    point_xy = np.asarray(point_xy, dtype="float64").reshape(-1, 2)
+    point_weights = np.nan_to_num(
+        np.asarray(point_weights, dtype="float64").reshape(len(point_xy), -1), nan=0.0
+    )
+    field_count = point_weights.shape[1]
+    stencil = quartic_kernel_stencil(search_radius, cell_size)
+    pad = stencil.shape[0] // 2
+    padded_rows, padded_cols = n_rows + 2 * pad, n_cols + 2 * pad
+    y_max = y_min + n_rows * cell_size
+    cols = np.floor((point_xy[:, 0] - x_min) / cell_size).astype("int64") + pad
+    rows = np.floor((y_max - point_xy[:, 1]) / cell_size).astype("int64") + pad
+    inside = (rows >= 0) & (rows < padded_rows) & (cols >= 0) & (cols < padded_cols)
+    flat_cells = rows[inside] * padded_cols + cols[inside]
+    if out is None:
+        out = np.empty((field_count, n_rows, n_cols), dtype="float64")
+    batch_size = max(int(max_batch_cells // (padded_rows * padded_cols)), 1)
+    for batch_start in range(0, field_count, batch_size):
+        batch = range(batch_start, min(batch_start + batch_size, field_count))
+        field_offsets = np.repeat(np.arange(len(batch)), len(flat_cells))
+        binned = np.bincount(
+            field_offsets * padded_rows * padded_cols + np.tile(flat_cells, len(batch)),
+            weights=point_weights[inside][:, batch].T.ravel(),
+            minlength=len(batch) * padded_rows * padded_cols,
+        ).reshape(len(batch), padded_rows, padded_cols)
+        surfaces = signal.fftconvolve(
+            binned, stencil[np.newaxis], mode="same", axes=(1, 2)
+        )
+        surfaces = np.maximum(surfaces[:, pad : pad + n_rows, pad : pad + n_cols], 0.0)
+        out[batch_start : batch.stop] = surfaces * float(area_factor)
+    return out
+
+
+def create_multiband_raster(out_path, grid, band_count, spatial_reference=None):
+    """Creates an ESRI BSQ (band sequential) float32 raster with a header and returns it as a writable numpy
+    memory map of shape (bands, rows, cols), so surfaces can be written without holding them in memory. The
+    raster extension is set to .bsq, and a .prj is written if a spatial reference is passed.
+    :returns - numpy.memmap"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    base_path = os.path.splitext(str(out_path))[0]
+    header = [
+        "BYTEORDER I",
+        "LAYOUT BSQ",
+        "NROWS {0}".format(n_rows),
+        "NCOLS {0}".format(n_cols),
+        "NBANDS {0}".format(band_count),
+        "NBITS 32",
+        "PIXELTYPE FLOAT",
+        "BANDROWBYTES {0}".format(n_cols * 4),
+        "TOTALROWBYTES {0}".format(n_cols * 4),
+        "ULXMAP {0!r}".format(x_min + cell_size / 2.0),
+        "ULYMAP {0!r}".format(y_min + (n_rows - 0.5) * cell_size),
+        "XDIM {0!r}".format(cell_size),
+        "YDIM {0!r}".format(cell_size),
+    ]
+    with open(base_path + ".hdr", "w") as header_file:
+        header_file.write("\n".join(header) + "\n")
+    if spatial_reference is not None:
+        with open(base_path + ".prj", "w") as prj_file:
+            prj_file.write(spatial_reference.exportToString())
+    return open_multiband_raster(out_path, grid, band_count, "w+")
+
+
+def open_multiband_raster(out_path, grid, band_count, mode="r+"):
+    """Opens the .bsq file of a raster from create_multiband_raster as a numpy memory map of shape
+    (bands, rows, cols). Separate processes can open it in r+ mode and write disjoint windows.
+    :returns - numpy.memmap"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    return np.memmap(
+        os.path.splitext(str(out_path))[0] + ".bsq",
+        dtype="<f4",
+        mode=mode,
+        shape=(int(band_count), n_rows, n_cols),
+    )
+
+
+def write_multiband_raster(surfaces, grid, out_path, spatial_reference=None):
+    """Saves a stacked (bands, rows, cols) array as a raster with arcpy.NumPyArrayToRaster, compositing bands when
+    there is more than one. Used for geodatabase outputs that cannot be memory-mapped files.
+    :returns - out_path"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    band_rasters = [
+        arcpy.NumPyArrayToRaster(
+            np.asarray(band, dtype="float32"),
+            arcpy.Point(x_min, y_min),
+            cell_size,
+            cell_size,
+        )
+        for band in surfaces
+    ]
+    if len(band_rasters) == 1:
+        band_rasters[0].save(out_path)
+    else:
+        arcpy.CompositeBands_management(band_rasters, out_path)
+    if spatial_reference is not None:
+        arcpy.DefineProjection_management(out_path, spatial_reference)
+    return out_path
+
+
+def create_snap_raster(grid, out_path, spatial_reference=None):
+    """Saves a one cell raster on the lower left cell of a grid, for use as arcpy.env.snapRaster so Spatial
+    Analyst outputs line up with the grid's cells whatever their extent.
+    :returns - out_path"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    arcpy.NumPyArrayToRaster(
+        np.zeros((1, 1), dtype="float32"),
+        arcpy.Point(x_min, y_min),
+        cell_size,
+        cell_size,
+    ).save(out_path)
+    if spatial_reference is not None:
+        arcpy.DefineProjection_management(out_path, spatial_reference)
+    return out_path
+
+
+def window_grid(grid, window):
+    """Returns the grid definition of a window of whole cells of a grid.
+    :param - grid - tuple of (x_min, y_min, cell_size, n_rows, n_cols)
+    :param - window - tuple of (row_start, row_stop, col_start, col_stop) in grid cells
+    :returns - grid tuple whose cells coincide with the parent grid's cells"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    row_start, row_stop, col_start, col_stop = window
+    return (
+        x_min + col_start * cell_size,
+        y_min + (n_rows - row_stop) * cell_size,
+        cell_size,
+        row_stop - row_start,
+        col_stop - col_start,
+    )
+
+
+def grid_tile_cells(grid, tile_size):
+    """Returns the width of a tile in whole cells for a tile size in map units."""
+    return max(int(round(float(tile_size) / grid[2])), 1)
+
+
+def grid_tiles(grid, tile_size, halo=0.0):
+    """Splits a grid into square tiles of whole cells, in row major order, each with a halo of extra cells around
+    it. Tiles are aligned to the parent grid's cells, so values computed on a tile's halo window match the values a
+    computation on the whole grid gives for the tile's core cells.
+    :param - grid - tuple of (x_min, y_min, cell_size, n_rows, n_cols)
+    :param - tile_size - tile width in map units, rounded to whole cells
+    :param - halo - halo width in map units, rounded up to whole cells
+    :returns - list of (core_window, halo_window) tuples of (row_start, row_stop, col_start, col_stop)
+    """
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    tile_cells = grid_tile_cells(grid, tile_size)
+    halo_cells = int(np.ceil(float(halo) / cell_size))
+    tiles = []
+    for row_start in range(0, n_rows, tile_cells):
+        for col_start in range(0, n_cols, tile_cells):
+            row_stop = min(row_start + tile_cells, n_rows)
+            col_stop = min(col_start + tile_cells, n_cols)
+            core_window = (row_start, row_stop, col_start, col_stop)
+            halo_window = (
+                max(row_start - halo_cells, 0),
+                min(row_stop + halo_cells, n_rows),
+                max(col_start - halo_cells, 0),
+                min(col_stop + halo_cells, n_cols),
+            )
+            tiles.append((core_window, halo_window))
+    return tiles
+
+
+def grid_tile_index(grid, tile_size, xy):
+    """Returns the position in grid_tiles of the tile whose core holds each point. Points outside the grid are
+    assigned to the nearest edge tile."""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    tile_cells = grid_tile_cells(grid, tile_size)
+    rows = np.clip(
+        np.floor((y_min + n_rows * cell_size - xy[:, 1]) / cell_size), 0, n_rows - 1
+    ).astype("int64")
+    cols = np.clip(np.floor((xy[:, 0] - x_min) / cell_size), 0, n_cols - 1).astype(
+        "int64"
+    )
+    tile_cols = -(-n_cols // tile_cells)
+    return (rows // tile_cells) * tile_cols + cols // tile_cells
+
+
+def grid_extent(grid, buffer=0.0):
+    """Returns the (x_min, y_min, x_max, y_max) extent of a grid, optionally expanded by a buffer."""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    return (
+        x_min - buffer,
+        y_min - buffer,
+        x_min + n_cols * cell_size + buffer,
+        y_min + n_rows * cell_size + buffer,
+    )
+
+
+def raster_to_array_grid(in_raster):
+    """Loads a raster into a float64 array with NoData as NaN, along with its grid (see raster_grid). Multiband
+    rasters return a (bands, rows, cols) array.
+    :param - in_raster - raster path or arcpy Raster
+    :returns - tuple of (array, grid)"""
+    raster = arcpy.Raster(in_raster) if isinstance(in_raster, str) else in_raster
+    raster_array = arcpy.RasterToNumPyArray(raster, nodata_to_value=np.nan).astype(
+        "float64", copy=False
+    )
+    grid = (
+        raster.extent.XMin,
+        raster.extent.YMin,
+        float(raster.meanCellWidth),
+        int(raster.height),
+        int(raster.width),
+    )
+    return raster_array, grid
+
+
+def sample_raster_array(raster_array, grid, xy, method="BILINEAR"):
+    """Samples a raster array at many point coordinates at once, without writing point features. Works on in
+    memory arrays and memory-mapped rasters alike, reading only the cells that are sampled. NEAREST returns the
+    value of the cell containing each point. BILINEAR interpolates between the four nearest cell centers, holding
+    edge values constant past the outer cell centers. Points outside the grid get NaN.
+    :param - raster_array - (rows, cols) or (bands, rows, cols) array, row 0 at the top
+    :param - grid - tuple of (x_min, y_min, cell_size, n_rows, n_cols)
+    :param - xy - (N, 2) point coordinates in the raster's spatial reference
+    :param - method - NEAREST or BILINEAR
+    :returns - (N,) values for a single band array, or (N, bands)"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    single_band = np.ndim(raster_array) == 2
+    bands = raster_array[None] if single_band else raster_array
+    xy = np.asarray(xy, dtype="float64").reshape(-1, 2)
+    col_position = (xy[:, 0] - x_min) / cell_size
+    row_position = (y_min + n_rows * cell_size - xy[:, 1]) / cell_size
+    inside = (
+        (col_position >= 0)
+        & (col_position <= n_cols)
+        & (row_position >= 0)
+        & (row_position <= n_rows)
+    )
+    values = np.full((len(xy), len(bands)), np.nan, dtype="float64")
+    col_position, row_position = col_position[inside], row_position[inside]
+    if str(method).upper() == "NEAREST":
+        rows = np.minimum(row_position.astype("int64"), n_rows - 1)
+        cols = np.minimum(col_position.astype("int64"), n_cols - 1)
+        values[inside] = np.asarray(bands[:, rows, cols], dtype="float64").T
+    else:
+        col_center = np.clip(col_position - 0.5, 0, n_cols - 1)
+        row_center = np.clip(row_position - 0.5, 0, n_rows - 1)
+        col_0 = np.minimum(col_center.astype("int64"), max(n_cols - 2, 0))
+        row_0 = np.minimum(row_center.astype("int64"), max(n_rows - 2, 0))
+        col_1 = np.minimum(col_0 + 1, n_cols - 1)
+        row_1 = np.minimum(row_0 + 1, n_rows - 1)
+        col_weight = (col_center - col_0)[:, None]
+        row_weight = (row_center - row_0)[:, None]
+
+        def corner(rows, cols):
+            return np.asarray(bands[:, rows, cols], dtype="float64").T
+
+        top = (
+            corner(row_0, col_0) * (1 - col_weight) + corner(row_0, col_1) * col_weight
+        )
+        bottom = (
+            corner(row_1, col_0) * (1 - col_weight) + corner(row_1, col_1) * col_weight
+        )
+        values[inside] = top * (1 - row_weight) + bottom * row_weight
+    return values[:, 0] if single_band else values
+
+
+###########################
+# Segmented Reductions
+###########################
+
+# Statistics segment_reduce computes directly. Other pandas agg names are computed with a pandas groupby.
+SEGMENT_STATISTICS = (
+    "sum",
+    "mean",
+    "min",
+    "max",
+    "median",
+    "mode",
+    "count",
+    "first",
+    "last",
+)
+
+
+def segment_sort(group_ids):
+    """Sorts group IDs once so that every group occupies one contiguous segment.
+    :param - group_ids - (N,) group ID of every row
+    :returns - tuple of (order (N,), segment_starts (G,), segment_ids (G,)) where order sorts rows by group,
+        segment_starts is the first sorted position of each group, and segment_ids are the sorted unique IDs
+    """
+    group_ids = np.asarray(group_ids)
+    order = np.argsort(group_ids, kind="stable")
+    sorted_ids = group_ids[order]
+    segment_starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    if len(sorted_ids) == 0:
+        segment_starts = segment_starts[:0]
+    return order, segment_starts, sorted_ids[segment_starts]
+
+
+def segment_value_sort(sorted_values, segment_starts):
+    """Sorts every column of a segmented value matrix by value within its segments with one lexsort over
+    (field, segment, value) keys, so all fields are ordered in a single pass. Null (NaN) values sort to the end of
+    their segment.
+    :param - sorted_values - (N, F) values sorted so each group is one contiguous segment
+    :param - segment_starts - (G,) first row of each segment (see segment_sort)
+    :returns - tuple of (value_sorted (N, F), counts (G, F)) where every segment of each column of value_sorted is
+        in ascending order and counts is the number of non null values in each segment and field
+    """
+    sorted_values = np.asarray(sorted_values, dtype="float64")
+    row_count, field_count = sorted_values.shape
+    segment_lengths = np.diff(np.r_[segment_starts, row_count]).astype("int64")
+    segment_index = np.repeat(np.arange(len(segment_starts)), segment_lengths)
+    field_values = sorted_values.T.reshape(-1)
+    segment_keys = (
+        np.arange(field_count)[:, None] * len(segment_starts) + segment_index
+    ).reshape(-1)
+    # Segments are contiguous and ordered, so every key keeps its rows in place and only values move
+    value_sorted = field_values[np.lexsort((field_values, segment_keys))]
+    value_sorted = value_sorted.reshape(field_count, row_count).T
+    counts = np.add.reduceat(
+        ~np.isnan(sorted_values), segment_starts, axis=0, dtype="int64"
+    )
+    return value_sorted, counts
+
+
+def grouped_median(sorted_values, segment_starts):
+    """Computes the exact median of every column of a value matrix over contiguous segments. Values are sorted
+    once by (segment, value) with segment_value_sort and the middle elements are read from the segment
+    boundaries. Null (NaN) values are skipped and segments without values return NaN.
+    :param - sorted_values - (N,) or (N, F) values sorted so each group is one contiguous segment
+    :param - segment_starts - (G,) first row of each segment (see segment_sort)
+    :returns - (G, F) float64 array (or (G,) for one dimensional values)"""
+    sorted_values = np.asarray(sorted_values, dtype="float64")
+    one_dimensional = sorted_values.ndim == 1
+    if one_dimensional:
+        sorted_values = sorted_values[:, None]
+    segment_starts = np.asarray(segment_starts, dtype="int64")
+    if len(segment_starts) == 0:
+        medians = np.empty((0, sorted_values.shape[1]), dtype="float64")
+    else:
+        value_sorted, counts = segment_value_sort(sorted_values, segment_starts)
+        lower = segment_starts[:, None] + np.maximum(counts - 1, 0) // 2
+        upper = segment_starts[:, None] + counts // 2
+        medians = (
+            np.take_along_axis(value_sorted, lower, axis=0)
+            + np.take_along_axis(value_sorted, upper, axis=0)
+        ) / 2.0
+        medians[counts == 0] = np.nan
+    return medians[:, 0] if one_dimensional else medians
+
+
+def grouped_mode(sorted_values, segment_starts):
+    """Computes the exact mode of every column of a value matrix over contiguous segments. Values are sorted once
+    by (segment, value) with segment_value_sort, runs of equal values are found from the boundaries of the sorted
+    values, and the longest run of each segment is kept. Ties go to the smallest value. Null (NaN) values are
+    skipped and segments without values return NaN.
+    :param - sorted_values - (N,) or (N, F) values sorted so each group is one contiguous segment
+    :param - segment_starts - (G,) first row of each segment (see segment_sort)
+    :returns - (G, F) float64 array (or (G,) for one dimensional values)"""
+    sorted_values = np.asarray(sorted_values, dtype="float64")
+    one_dimensional = sorted_values.ndim == 1
+    if one_dimensional:
+        sorted_values = sorted_values[:, None]
+    segment_starts = np.asarray(segment_starts, dtype="int64")
+    segment_count, field_count = len(segment_starts), sorted_values.shape[1]
+    modes = np.full(segment_count * field_count, np.nan)
+    if segment_count and len(sorted_values):
+        value_sorted, _ = segment_value_sort(sorted_values, segment_starts)
+        segment_lengths = np.diff(np.r_[segment_starts, len(sorted_values)])
+        field_values = value_sorted.T.reshape(-1)
+        segment_keys = (
+            np.arange(field_count)[:, None] * segment_count
+            + np.repeat(np.arange(segment_count), segment_lengths)
+        ).reshape(-1)
+        run_starts = np.flatnonzero(
+            np.r_[
+                True,
+                (segment_keys[1:] != segment_keys[:-1])
+                | (field_values[1:] != field_values[:-1]),
+            ]
+        )
+        run_lengths = np.diff(np.r_[run_starts, len(field_values)])
+        run_keys, run_values = segment_keys[run_starts], field_values[run_starts]
+        valid = ~np.isnan(run_values)
+        run_keys, run_values, run_lengths = (
+            run_keys[valid],
+            run_values[valid],
+            run_lengths[valid],
+        )
+        # Runs are in ascending value order within each key, and the stable lexsort keeps the smallest value first
+        run_order = np.lexsort((-run_lengths, run_keys))
+        run_keys, first_runs = np.unique(run_keys[run_order], return_index=True)
+        modes[run_keys] = run_values[run_order][first_runs]
+    modes = modes.reshape(field_count, segment_count).T
+    return modes[:, 0] if one_dimensional else modes
+
+
+def segment_reduce(values, order, segment_starts, statistic="median", out=None):
+    """Reduces every column of a value matrix over the segments from segment_sort with reduceat style ufunc
+    reductions. Medians and modes are exact and sort all columns by segment and value once (see grouped_median and
+    grouped_mode). NaN values are treated as 0.
+    :param - values - (N,) or (N, F) values in the original row order
+    :param - order, segment_starts - arrays returned by segment_sort
+    :param - statistic - one of SEGMENT_STATISTICS, or another pandas agg function name
+    :param - out - optional preallocated (G, F) float64 output block
+    :returns - (G, F) array of reduced values (or (G,) for one dimensional values)"""
+    statistic = str(statistic).lower()
+    values = np.asarray(values, dtype="float64")
+    one_dimensional = values.ndim == 1
+    sorted_values = np.nan_to_num(
+        (values[:, None] if one_dimensional else values)[order]
+    )
+    segment_count, field_count = len(segment_starts), sorted_values.shape[1]
+    if out is None:
+        out = np.empty((segment_count, field_count), dtype="float64")
+    segment_lengths = np.diff(np.r_[segment_starts, len(order)])
+    if segment_count == 0:
+        pass
+    elif statistic == "sum":
+        np.add.reduceat(sorted_values, segment_starts, axis=0, out=out)
+    elif statistic == "mean":
+        np.add.reduceat(sorted_values, segment_starts, axis=0, out=out)
+        out /= segment_lengths[:, None]
+    elif statistic == "min":
+        np.minimum.reduceat(sorted_values, segment_starts, axis=0, out=out)
+    elif statistic == "max":
+        np.maximum.reduceat(sorted_values, segment_starts, axis=0, out=out)
+    elif statistic == "count":
+        out[:] = segment_lengths[:, None]
+    elif statistic == "first":
+        out[:] = sorted_values[segment_starts]
+    elif statistic == "last":
+        out[:] = sorted_values[segment_starts + segment_lengths - 1]
+    elif statistic == "median":
+        out[:] = grouped_median(sorted_values, segment_starts)
+    elif statistic == "mode":
+        out[:] = grouped_mode(sorted_values, segment_starts)
+    else:
+        grouped = (
+            pd.DataFrame(sorted_values)
+            .groupby(np.repeat(np.arange(segment_count), segment_lengths))
+            .agg(statistic)
+        )
+        out[:] = grouped.to_numpy(dtype="float64")
+    return out[:, 0] if one_dimensional else out
+
+
+def hash_group_keys(frame, field_types):
+    """Hashes the field values of every row of a DataFrame to one 64-bit key with vectorized pandas hashing.
+    Columns are cast by their arcpy field types rather than by the dtype pandas infers for a read, so the key of a
+    value does not depend on the other values read with it (such as a numeric field read as objects when all of
+    its values are null). Numeric fields are hashed as float64, dates as datetime64[ns] and other fields as
+    objects. Null values hash to a fixed value for each field type.
+    :param - frame - pandas DataFrame of group fields
+    :param - field_types - arcpy field type of each column of frame ("Integer", "Double", "Date", "String"...)
+    :returns - (N,) uint64 array of row keys"""
+    columns = {}
+    for field, field_type in zip(frame.columns, field_types):
+        column = frame[field]
+        if field_type == "Date":
+            columns[field] = pd.to_datetime(column).astype("datetime64[ns]")
+        elif field_type in NUMERIC_FIELD_TYPES:
+            columns[field] = column.astype("float64")
+        else:
+            columns[field] = column.astype(object)
+    return pd.util.hash_pandas_object(
+        pd.DataFrame(columns, index=frame.index), index=False
+    ).to_numpy(dtype="uint64")
+
+
+def hashed_group_index(row_chunks, fields, field_types):
+    """Groups rows read in chunks by 64-bit hashed keys of their field values (see hash_group_keys). Only the
+    sorted group keys and the first row of each group are kept between chunks, so memory apart from the (N,)
+    group index depends on the number of groups rather than the number of rows. Groups are numbered in the order
+    they are first read, and a verification pass compares every row with the first row of its group so that a
+    hash collision raises an error instead of merging groups.
+    :param - row_chunks - iterable of lists of row tuples of group field values, such as cursor rows
+    :param - fields - names of the group fields, in the order of the row values
+    :param - field_types - arcpy field type of each group field
+    :returns - tuple of (group_keys (G,) uint64 key of each group, first_values list of the first row tuple of
+        each group, group_index (N,) int64 group of every row)"""
+    sorted_keys = np.empty(0, dtype="uint64")
+    sorted_groups = np.empty(0, dtype="int64")
+    first_values, group_index = [], []
+    for rows in row_chunks:
+        if not len(rows):
+            continue
+        frame = pd.DataFrame.from_records(rows, columns=fields)
+        chunk_keys, chunk_first, chunk_inverse = np.unique(
+            hash_group_keys(frame, field_types), return_index=True, return_inverse=True
+        )
+        positions = np.searchsorted(sorted_keys, chunk_keys)
+        known = positions < len(sorted_keys)
+        known[known] = sorted_keys[positions[known]] == chunk_keys[known]
+        chunk_groups = np.empty(len(chunk_keys), dtype="int64")
+        chunk_groups[known] = sorted_groups[positions[known]]
+        # New groups are numbered in the order their first rows were read
+        new = np.flatnonzero(~known)
+        new_order = new[np.argsort(chunk_first[new], kind="stable")]
+        chunk_groups[new_order] = np.arange(
+            len(first_values), len(first_values) + len(new_order)
+        )
+        first_values.extend(rows[row] for row in chunk_first[new_order].tolist())
+        sorted_keys = np.insert(sorted_keys, positions[new], chunk_keys[new])
+        sorted_groups = np.insert(sorted_groups, positions[new], chunk_groups[new])
+        chunk_inverse = chunk_inverse.reshape(-1)
+        first_frame = pd.DataFrame.from_records(
+            [first_values[group] for group in chunk_groups.tolist()], columns=fields
+        )
+        for field in fields:
+            values = frame[field].to_numpy()
+            group_values = first_frame[field].to_numpy()[chunk_inverse]
+            same = pd.isna(values) & pd.isna(group_values)
+            same[~same] = values[~same] == group_values[~same]
+            if not same.all():
+                raise ValueError(
+                    "Hash collision between group keys of field {0}. Use exact keys.".format(
+                        field
+                    )
+                )
+        group_index.append(chunk_groups[chunk_inverse])
+    group_keys = np.empty(len(sorted_keys), dtype="uint64")
+    group_keys[sorted_groups] = sorted_keys
+    group_index = (
+        np.concatenate(group_index) if group_index else np.empty(0, dtype="int64")
+    )
+    return group_keys, first_values, group_index
+
+
+###########################
+# Merge Rules
+###########################
+
+# Spatial join merge rules evaluated by merge_rule_reduce, in the order the statistical spatial join tool lists them.
+MERGE_RULES = (
+    "SUM",
+    "MEAN",
+    "MEDIAN",
+    "MODE",
+    "STD",
+    "MIN",
+    "MAX",
+    "RANGE",
+    "COUNT",
+    "FIRST",
+    "LAST",
+)
+# Merge rules scatter_merge_rule accumulates without sorting the pairs by group.
+SCATTER_MERGE_RULES = ("SUM", "MEAN", "MIN", "MAX", "RANGE", "COUNT")
+NUMERIC_FIELD_TYPES = (
+    "SmallInteger",
+    "Integer",
+    "BigInteger",
+    "Single",
+    "Double",
+    "OID",
+)
+
+
+def arcgis_table_to_arrays(in_table, value_fields, query=""):
+    """Reads numeric fields in bulk with an arcpy.da.SearchCursor into a float64 matrix sorted by object ID. Null
+    values are returned as NaN.
+    :param - in_table - input table or feature class
+    :param - value_fields - numeric fields to return as value columns
+    :param - query - sql query to grab appropriate rows
+    :returns - tuple of (oids (N,), values (N, len(value_fields)))"""
+    cursor_fields = ["OID@"] + list(value_fields)
+    with arcpy.da.SearchCursor(in_table, cursor_fields, where_clause=query) as cursor:
+        rows = np.array([row for row in cursor], dtype="float64").reshape(
+            -1, len(cursor_fields)
+        )
+    rows = rows[np.argsort(rows[:, 0], kind="stable")]
+    return rows[:, 0].astype("int64"), rows[:, 1:]
+
+
+def update_rows_from_arrays(in_table, oids, field_arrays, query=""):
+    """Writes columns of values to a table in one arcpy.da.UpdateCursor pass. Rows are matched to their values by
+    object ID, and rows whose object IDs are not passed are left unchanged.
+    :param - in_table - input table or feature class to update
+    :param - oids - (N,) object IDs of the rows to update
+    :param - field_arrays - dictionary of {field name: (N,) values in the order of oids}
+    :param - query - sql query to limit the rows visited by the cursor
+    :returns - number of updated rows"""
+    fields = list(field_arrays)
+    oid_positions = {
+        oid: position for position, oid in enumerate(np.asarray(oids).tolist())
+    }
+    # Python lists hand the cursor native values, and NaN in float columns is written as null
+    columns = [
+        [
+            None if isinstance(value, float) and value != value else value
+            for value in np.asarray(field_arrays[field]).tolist()
+        ]
+        for field in fields
+    ]
+    updated = 0
+    with arcpy.da.UpdateCursor(
+        in_table, ["OID@"] + fields, where_clause=query
+    ) as cursor:
+        for row in cursor:
+            position = oid_positions.get(row[0])
+            if position is not None:
+                cursor.updateRow([row[0]] + [column[position] for column in columns])
+                updated += 1
+    return updated
+
+
+def linear_distance_to_map_units(distance, spatial_reference):
+    """Converts a distance given as a number in map units or as linear unit text ("100 Meters", "0.5 Miles") to the
+    map units of a spatial reference.
+    :returns - float distance, or None for an empty distance (including the "#" placeholder)"""
+    if distance is None or str(distance).strip() in ("", "#"):
+        return None
+    parts = str(distance).split()
+    value = float(parts[0])
+    if len(parts) > 1 and normalize_unit_name(parts[1]) != "UNKNOWN":
+        value /= geometry_conversion_factor(spatial_reference, parts[1])
+    return value
+
+
+def point_distance_pairs(
+    target_xy,
+    join_xy,
+    search_radius=None,
+    closest=False,
+    chunk_size=1000000,
+    workers=-1,
+):
+    """Finds matching (target, join) point pairs with a KD-tree over the join points. Targets are queried in
+    chunks, and each query runs on workers threads (-1 uses every core). Without closest, every join point within
+    the search radius (inclusive) matches. With closest, the nearest join point matches, optionally only within
+    the search radius.
+    :param - target_xy - (N, 2) target point coordinates
+    :param - join_xy - (M, 2) join point coordinates in the same planar spatial reference
+    :param - search_radius - match distance in map units
+    :param - closest - match only the nearest join point
+    :param - chunk_size - targets per KD-tree query
+    :param - workers - threads per KD-tree query
+    :returns - tuple of (target_index (P,), join_index (P,)) positions in the input arrays
+    """
+    target_xy = np.asarray(target_xy, dtype="float64").reshape(-1, 2)
+    join_xy = np.asarray(join_xy, dtype="float64").reshape(-1, 2)
+    target_parts, join_parts = [], []
+    if len(target_xy) and len(join_xy):
+        join_tree = cKDTree(join_xy)
+        for start in range(0, len(target_xy), int(chunk_size)):
+            chunk = target_xy[start : start + int(chunk_size)]
+            if closest:
+                distances, nearest = join_tree.query(
+                    chunk,
+                    k=1,
+                    distance_upper_bound=(
+                        np.inf if search_radius is None else search_radius
+                    ),
+                    workers=workers,
+                )
+                found = np.isfinite(distances)
+                target_parts.append(np.flatnonzero(found) + start)
+                join_parts.append(nearest[found])
+            else:
+                neighbors = join_tree.query_ball_point(
+                    chunk, float(search_radius or 0.0), workers=workers
+                )
+                counts = np.fromiter(
+                    (len(neighbor) for neighbor in neighbors), "int64", len(chunk)
+                )
+                target_parts.append(np.repeat(np.arange(len(chunk)) + start, counts))
+                join_parts.append(
+                    np.fromiter(
+                        itertools.chain.from_iterable(neighbors), "int64", counts.sum()
+                    )
+                )
+    if not target_parts:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="int64")
+    return (
+        np.concatenate(target_parts).astype("int64"),
+        np.concatenate(join_parts).astype("int64"),
+    )
+
+
+def spatial_join_pairs(
+    target_features,
+    join_features,
+    match_option="INTERSECT",
+    search_radius=None,
+    cache_folder="",
+    workers=-1,
+):
+    """Returns every (target OID, join OID) pair matching a spatial relationship, using a JOIN_ONE_TO_MANY
+    SpatialJoin with no attribute fields. Pairs are sorted by target and then join OID. When both inputs are
+    points in a projected coordinate system and the match option is WITHIN_A_DISTANCE or CLOSEST, the pairs come
+    from point_distance_pairs on bulk read coordinates instead of the overlay. Polygon targets intersected with
+    point join features without a search radius are matched with points_in_polygons, counting points within the
+    XY tolerance of a boundary as SpatialJoin does. With a cache folder the
+    pairs are stored as int64 arrays keyed by the geometry fingerprints of both inputs, the match option and the
+    search radius, so joins that only change attributes or merge rules reuse them. Both inputs are fingerprinted
+    by their vertices in the target spatial reference, so any vertex edit of either input or a change of the
+    target spatial reference computes the pairs again.
+    :param - target_features - target feature class
+    :param - join_features - join feature class
+    :param - match_option - SpatialJoin match option
+    :param - search_radius - SpatialJoin search radius
+    :param - cache_folder - optional folder for cached pairs
+    :param - workers - threads used by the KD-tree point queries
+    :returns - tuple of (target_ids (P,), join_ids (P,)) int64 arrays"""
+    target_describe = arcpy.Describe(target_features)
+    spatial_reference = target_describe.spatialReference
+    cache_path = None
+    if cache_folder:
+        cache_path = array_cache_path(
+            cache_folder,
+            "spatial_join_pairs",
+            geometry_fingerprint(target_features, spatial_reference),
+            geometry_fingerprint(join_features, spatial_reference),
+            str(match_option).upper(),
+            search_radius,
+        )
+        cached = load_array_cache(cache_path)
+        if cached is not None:
+            arc_print("Loaded cached spatial join pairs from {0}.".format(cache_path))
+            return (
+                cached["target_ids"].astype("int64"),
+                cached["join_ids"].astype("int64"),
+            )
+    if (
+        str(match_option).upper() in ("WITHIN_A_DISTANCE", "CLOSEST")
+        and target_describe.shapeType == "Point"
+        and arcpy.Describe(join_features).shapeType == "Point"
+        and spatial_reference.type == "Projected"
+    ):
+        target_oids, target_xy, _ = arcgis_points_to_arrays(target_features)
+        join_oids, join_xy, _ = arcgis_points_to_arrays(
+            join_features, spatial_reference=spatial_reference
+        )
+        target_index, join_index = point_distance_pairs(
+            target_xy,
+            join_xy,
+            linear_distance_to_map_units(search_radius, spatial_reference),
+            str(match_option).upper() == "CLOSEST",
+            workers=workers,
+        )
+        target_ids, join_ids = target_oids[target_index], join_oids[join_index]
+    elif (
+        str(match_option).upper() == "INTERSECT"
+        and not linear_distance_to_map_units(search_radius, spatial_reference)
+        and target_describe.shapeType == "Polygon"
+        and arcpy.Describe(join_features).shapeType == "Point"
+    ):
+        target_oids, coords, path_offsets, path_feature = arcgis_geometry_to_arrays(
+            target_features
+        )
+        join_oids, join_xy, _ = arcgis_points_to_arrays(
+            join_features, spatial_reference=spatial_reference
+        )
+        join_index, target_index = points_in_polygons(
+            join_xy,
+            coords,
+            path_offsets,
+            path_feature,
+            len(target_oids),
+            tolerance=getattr(spatial_reference, "XYTolerance", 0.0),
+        )
+        target_ids, join_ids = target_oids[target_index], join_oids[join_index]
+    else:
+        temp_pairs = "memory/spatial_join_pairs"
+        arcpy.SpatialJoin_analysis(
+            target_features=target_features,
+            join_features=join_features,
+            out_feature_class=temp_pairs,
+            join_operation="JOIN_ONE_TO_MANY",
+            join_type="KEEP_COMMON",
+            field_mapping=arcpy.FieldMappings(),
+            match_option=match_option,
+            search_radius=search_radius,
+        )
+        pairs = arcpy.da.TableToNumPyArray(temp_pairs, ["TARGET_FID", "JOIN_FID"])
+        arcpy.Delete_management(temp_pairs)
+        target_ids = pairs["TARGET_FID"].astype("int64")
+        join_ids = pairs["JOIN_FID"].astype("int64")
+    order = np.lexsort((join_ids, target_ids))
+    target_ids, join_ids = target_ids[order], join_ids[order]
+    if cache_path:
+        save_array_cache(
+            cache_path,
+            target_ids=target_ids.astype("int64"),
+            join_ids=join_ids.astype("int64"),
+        )
+    return target_ids, join_ids
+
+
+def scatter_merge_rule(group_index, values, group_count, merge_rule="SUM"):
+    """Evaluates a SUM, MEAN, MIN, MAX, RANGE or COUNT merge rule for every column of a value matrix by scattering
+    values into their groups in any order. Every field is accumulated in the same bincount or ufunc.at call over a
+    flattened (group, field) index, so the cost grows with the number of values, not the number of fields. Null
+    (NaN) values are skipped and groups without values return NaN (0 for COUNT).
+    :param - group_index - (P,) group position of every row, from 0 to group_count - 1
+    :param - values - (P, F) value matrix
+    :param - group_count - number of groups
+    :param - merge_rule - one of SCATTER_MERGE_RULES
+    :returns - (G, F) float64 array"""
+    merge_rule = str(merge_rule).upper()
+    values = np.asarray(values, dtype="float64")
+    field_count = values.shape[1]
+    cell_count = int(group_count) * field_count
+    valid = ~np.isnan(values)
+    flat_index = (
+        np.asarray(group_index, dtype="int64")[:, None] * field_count
+        + np.arange(field_count)
+    )[valid]
+    valid_values = values[valid]
+    counts = np.bincount(flat_index, minlength=cell_count).reshape(-1, field_count)
+    if merge_rule == "COUNT":
+        return counts.astype("float64")
+    if merge_rule in ("SUM", "MEAN"):
+        reduced = np.bincount(flat_index, valid_values, cell_count).reshape(
+            -1, field_count
+        )
+        if merge_rule == "MEAN":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                reduced = reduced / counts
+    else:
+        minimums = np.full(cell_count, np.inf)
+        maximums = np.full(cell_count, -np.inf)
+        if merge_rule in ("MIN", "RANGE"):
+            np.minimum.at(minimums, flat_index, valid_values)
+        if merge_rule in ("MAX", "RANGE"):
+            np.maximum.at(maximums, flat_index, valid_values)
+        reduced = {
+            "MIN": minimums,
+            "MAX": maximums,
+            "RANGE": maximums - minimums,
+        }[
+            merge_rule
+        ].reshape(-1, field_count)
+    reduced[counts == 0] = np.nan
+    return reduced
+
+
+def merge_rule_reduce(sorted_values, segment_starts, merge_rule="SUM"):
+    """Evaluates a spatial join merge rule for every column of a value matrix over contiguous segments. Null (NaN)
+    values are skipped as field map merge rules skip them, and segments without values return NaN (0 for COUNT).
+    STD is the sample standard deviation. FIRST and LAST take the first and last row of each segment.
+    :param - sorted_values - (N, F) values sorted so each group is one contiguous segment
+    :param - segment_starts - (G,) first row of each segment (see segment_sort)
+    :param - merge_rule - one of MERGE_RULES
+    :returns - (G, F) float64 array"""
+    merge_rule = str(merge_rule).upper()
+    sorted_values = np.asarray(sorted_values, dtype="float64")
+    segment_count, field_count = len(segment_starts), sorted_values.shape[1]
+    if segment_count == 0:
+        return np.empty((0, field_count), dtype="float64")
+    segment_lengths = np.diff(np.r_[segment_starts, len(sorted_values)])
+    valid = ~np.isnan(sorted_values)
+    counts = np.add.reduceat(valid.astype("int64"), segment_starts, axis=0)
+    if merge_rule == "COUNT":
+        return counts.astype("float64")
+    if merge_rule == "FIRST":
+        return sorted_values[segment_starts].copy()
+    if merge_rule == "LAST":
+        return sorted_values[segment_starts + segment_lengths - 1].copy()
+    if merge_rule == "MEDIAN":
+        return grouped_median(sorted_values, segment_starts)
+    if merge_rule == "MODE":
+        return grouped_mode(sorted_values, segment_starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sums = np.add.reduceat(
+            np.where(valid, sorted_values, 0.0), segment_starts, axis=0
+        )
+        if merge_rule == "SUM":
+            reduced = sums
+        elif merge_rule == "MEAN":
+            reduced = sums / counts
+        elif merge_rule == "STD":
+            segment_index = np.repeat(np.arange(segment_count), segment_lengths)
+            deviations = np.where(
+                valid, sorted_values - (sums / counts)[segment_index], 0.0
+            )
+            squares = np.add.reduceat(deviations**2, segment_starts, axis=0)
+            reduced = np.sqrt(squares / (counts - 1))
+            reduced[counts < 2] = np.nan
+        else:
+            minimums = np.minimum.reduceat(
+                np.where(valid, sorted_values, np.inf), segment_starts, axis=0
+            )
+            maximums = np.maximum.reduceat(
+                np.where(valid, sorted_values, -np.inf), segment_starts, axis=0
+            )
+            reduced = {
+                "MIN": minimums,
+                "MAX": maximums,
+                "RANGE": maximums - minimums,
+            }[merge_rule]
+    reduced[counts == 0] = np.nan
+    return reduced
+
+
+###########################
+# Array Cache
+###########################
+
+
+def array_fingerprint(arrays, *key_parts):
+    """Returns a hex digest of the bytes of a sequence of arrays and any extra key parts.
+    :param - arrays - sequence of numpy arrays
+    :param - key_parts - other values that distinguish the arrays (spatial references, parameters)
+    :returns - hex string"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array).tobytes())
+    for part in key_parts:
+        digest.update(str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def geometry_fingerprint(in_fc, spatial_reference=None):
+    """Returns a hex digest of the geometry of a feature class: the object ID and the well-known binary (every
+    vertex coordinate and the part structure) of each shape, streamed through the digest one row at a time. Added
+    or deleted features, any vertex edit (including reversed lines and reshapes that keep the centroid, length,
+    area and extent) and a different spatial reference change the fingerprint, so it can key arrays derived from
+    the geometry. Attribute edits, such as fields added by a tool, do not. The geometry is still read, so the
+    fingerprint saves the work derived from the vertices rather than the read itself.
+    :param - in_fc - input feature class
+    :param - spatial_reference - optional spatial reference the coordinates are read in
+    :returns - hex string"""
+    digest = hashlib.sha1()
+    feature_count = 0
+    with arcpy.da.SearchCursor(
+        in_fc, ["OID@", "SHAPE@WKB"], spatial_reference=spatial_reference
+    ) as cursor:
+        for oid, wkb in cursor:
+            wkb = bytes(wkb or b"")
+            digest.update("{0}:{1}:".format(oid, len(wkb)).encode("utf-8"))
+            digest.update(wkb)
+            feature_count += 1
+    return array_fingerprint(
+        (),
+        digest.hexdigest(),
+        feature_count,
+        *geometry_reference_key(spatial_reference),
+    )
+
+
+def geometry_reference_key(spatial_reference=None):
+    """Returns the spatial reference part of a fingerprint key as a tuple."""
+    if spatial_reference is None:
+        return ()
+    return (spatial_reference.exportToString(),)
+
+
+def array_cache_path(cache_folder, prefix, *key_parts):
+    """Returns the .npz path in cache_folder for the given key parts (fingerprints, parameters).
+    :param - cache_folder - folder holding cached arrays
+    :param - prefix - file name prefix describing what is cached
+    :param - key_parts - values that determine the cached result
+    :returns - file path"""
+    key = hashlib.sha1(
+        "|".join(str(part) for part in key_parts).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(cache_folder, "{0}_{1}.npz".format(prefix, key[:20]))
+
+
+def load_array_cache(cache_path):
+    """Loads every array of a cache file written by save_array_cache.
+    :param - cache_path - .npz path from array_cache_path
+    :returns - dictionary of name to array, or None when the file is missing or unreadable
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as cached:
+            return {name: cached[name] for name in cached.files}
+    except (OSError, ValueError) as e:
+        arcpy.AddWarning(
+            "Ignoring unreadable cache file {0}: {1}".format(cache_path, e)
+        )
+        return None
+
+
+def save_array_cache(cache_path, **arrays):
+    """Saves named arrays to an uncompressed .npz file. The file is written next to the target and moved into place,
+    so concurrent runs never read a partial cache.
+    :param - cache_path - .npz path from array_cache_path
+    :param - arrays - named arrays to store
+    :returns - cache_path"""
+    cache_folder = os.path.dirname(cache_path)
+    if cache_folder and not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    temp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+    with open(temp_path, "wb") as cache_file:
+        np.savez(cache_file, **arrays)
+    os.replace(temp_path, cache_path)
+    return cache_path
+
+
+def sample_point_arrays(
+    in_fc,
+    sample_percentage=10,
+    cache_folder="",
+    spatial_reference=None,
+    sampling_mode="PERCENTAGE",
+    sample_distance=None,
+    max_points=None,
+):
+    """Returns sample points for a feature class as coordinate and parent object ID arrays without creating point
+    features. Polylines are sampled with sample_path_points (one set of points per part), and polygons and points
+    are represented by their label point, which lies inside the feature. With a cache folder the arrays are stored
+    keyed by the geometry_fingerprint of in_fc and the sampling settings, and later calls on unchanged
+    geometry load them instead of sampling the geometry again.
+    :param - in_fc - input feature class
+    :param - sample_percentage - spacing of polyline samples as a percentage of line length (PERCENTAGE)
+    :param - cache_folder - optional folder for cached sample points
+    :param - spatial_reference - optional spatial reference of the returned coordinates
+    :param - sampling_mode - PERCENTAGE, DISTANCE or COUNT (see sample_path_points)
+    :param - sample_distance - spacing of polyline samples in map units (DISTANCE)
+    :param - max_points - points per line for COUNT, and the optional cap on points per line otherwise
+    :returns - tuple of (xy (N, 2), parent_ids (N,))"""
+    sampling_mode = str(sampling_mode).upper()
+    shape_type = str(arcpy.Describe(in_fc).shapeType)
+    cache_path = None
+    if cache_folder:
+        sampling_key = (
+            (sampling_mode, sample_percentage, sample_distance, max_points)
+            if shape_type == "Polyline"
+            else ("LABEL",)
+        )
+        cache_path = array_cache_path(
+            cache_folder,
+            "sample_points",
+            geometry_fingerprint(in_fc, spatial_reference),
+            *sampling_key,
+        )
+        cached = load_array_cache(cache_path)
+        if cached is not None:
+            arc_print("Loaded cached sample points from {0}.".format(cache_path))
+            return cached["xy"], cached["parent_ids"]
+    if shape_type == "Polyline":
+        oids, coords, path_offsets, path_feature = arcgis_geometry_to_arrays(
+            in_fc, spatial_reference=spatial_reference
+        )
+        sample_values = {
+            "PERCENTAGE": sample_percentage,
+            "DISTANCE": sample_distance,
+            "COUNT": max_points,
+        }
+        xy, sample_path = sample_path_points(
+            coords,
+            path_offsets,
+            sampling_mode,
+            sample_values[sampling_mode],
+            None if sampling_mode == "COUNT" else max_points,
+        )
+        parent_ids = oids[path_feature[sample_path]]
+    else:
+        parent_ids, xy = label_point_arrays(in_fc, spatial_reference)
+    if cache_path:
+        save_array_cache(cache_path, xy=xy, parent_ids=parent_ids)
+    return xy, parent_ids
+
+
+def label_point_arrays(in_fc, spatial_reference=None):
+    """Reads the label point of every feature, a point that lies inside polygons and on the feature otherwise.
+    :param - in_fc - input feature class
+    :param - spatial_reference - optional spatial reference of the returned coordinates
+    :returns - tuple of (oids (N,), xy (N, 2)). Null geometries are skipped."""
+    label_points = []
+    with arcpy.da.SearchCursor(
+        in_fc, ["OID@", "SHAPE@"], spatial_reference=spatial_reference
+    ) as cursor:
+        for oid, geometry in cursor:
+            if geometry is not None:
+                label_point = geometry.labelPoint
+                label_points.append((oid, label_point.X, label_point.Y))
+    label_points = np.array(label_points, dtype="float64").reshape(-1, 3)
+    return label_points[:, 0].astype("int64"), label_points[:, 1:]
+
+
+def polygon_cell_centers(coords, path_offsets, path_feature, feature_count, grid):
+    """Rasterizes polygons onto a grid by cell center. Every grid cell inside a polygon bounding box is a candidate
+    once, and candidates are tested with points_in_polygons, so a cell inside overlapping polygons is returned for
+    each of them.
+    :param - coords, path_offsets, path_feature - flattened polygon arrays (see geometry_to_path_arrays)
+    :param - feature_count - number of polygons
+    :param - grid - tuple of (x_min, y_min, cell_size, n_rows, n_cols)
+    :returns - tuple of (cell_xy (C, 2), polygon_index (C,))"""
+    x_min, y_min, cell_size, n_rows, n_cols = grid
+    y_max = y_min + n_rows * cell_size
+    boxes = path_bounding_boxes(coords, path_offsets, path_feature, feature_count)
+    boxes = boxes[~np.isnan(boxes).any(axis=1)]
+    col_start = np.clip(np.floor((boxes[:, 0] - x_min) / cell_size), 0, n_cols)
+    col_stop = np.clip(np.ceil((boxes[:, 2] - x_min) / cell_size), 0, n_cols)
+    row_start = np.clip(np.floor((y_max - boxes[:, 3]) / cell_size), 0, n_rows)
+    row_stop = np.clip(np.ceil((y_max - boxes[:, 1]) / cell_size), 0, n_rows)
+    row_counts = np.maximum(row_stop - row_start, 0).astype("int64")
+    col_counts = np.maximum(col_stop - col_start, 0).astype("int64")
+    box_rows, rows = expand_ranges(row_start, row_counts)
+    box_cols, cols = expand_ranges(
+        np.repeat(col_start, row_counts), np.repeat(col_counts, row_counts)
+    )
+    cells = np.unique(rows[box_cols] * n_cols + cols)
+    cell_xy = np.column_stack(
+        [
+            x_min + (cells % n_cols + 0.5) * cell_size,
+            y_max - (cells // n_cols + 0.5) * cell_size,
+        ]
+    )
+    cell_index, polygon_index = points_in_polygons(
+        cell_xy, coords, path_offsets, path_feature, feature_count
+    )
+    return cell_xy[cell_index], polygon_index
+
+
+def zonal_sample_arrays(in_fc, grid, spatial_reference=None):
+    """Returns the centers of the grid cells inside every polygon of a feature class as sample coordinates and
+    parent object IDs. Polygons too small to hold a cell center are sampled at their label point.
+    :param - in_fc - input polygon feature class
+    :param - grid - tuple of (x_min, y_min, cell_size, n_rows, n_cols) in spatial_reference
+    :param - spatial_reference - optional spatial reference of the grid and returned coordinates
+    :returns - tuple of (xy (N, 2), parent_ids (N,))"""
+    oids, coords, path_offsets, path_feature = arcgis_geometry_to_arrays(
+        in_fc, spatial_reference=spatial_reference
+    )
+    xy, polygon_index = polygon_cell_centers(
+        coords, path_offsets, path_feature, len(oids), grid
+    )
+    parent_ids = oids[polygon_index]
+    missing = np.setdiff1d(oids, parent_ids)
+    if len(missing):
+        label_oids, label_xy = label_point_arrays(in_fc, spatial_reference)
+        use_label = np.isin(label_oids, missing)
+        xy = np.concatenate([xy, label_xy[use_label]])
+        parent_ids = np.concatenate([parent_ids, label_oids[use_label]])
+    return xy, parent_ids
+
+
+def point_arrays_to_feature_class(out_fc, xy, field_arrays={}, spatial_reference=None):
+    """Writes point coordinates and attribute arrays to a new point feature class with
+    arcpy.da.NumPyArrayToFeatureClass.
+    :param - out_fc - output feature class
+    :param - xy - (N, 2) point coordinates
+    :param - field_arrays - dictionary of field name to (N,) attribute array
+    :param - spatial_reference - spatial reference of the coordinates
+    :returns - out_fc"""
+    fields = [
+        (str(name), np.asarray(values).dtype.str)
+        for name, values in field_arrays.items()
+    ]
+    point_array = np.empty(
+        len(xy), dtype=[("SHAPE_X", "<f8"), ("SHAPE_Y", "<f8")] + fields
+    )
+    point_array["SHAPE_X"], point_array["SHAPE_Y"] = xy[:, 0], xy[:, 1]
+    for name, values in field_arrays.items():
+        point_array[str(name)] = values
+    if arcpy.Exists(out_fc):
+        arcpy.Delete_management(out_fc)
+    arcpy.da.NumPyArrayToFeatureClass(
+        point_array, out_fc, ("SHAPE_X", "SHAPE_Y"), spatial_reference
+    )
+    return out_fc
+
+
+###########################
+# Parallel Processing
+###########################
+
+
+def resolve_worker_count(workers=1):
+    """Returns the number of worker processes to use. Zero or negative values count back from the CPU count, so -1
+    uses every core.
+    :param - workers - requested worker count
+    :returns - int from 1 to the CPU count"""
+    cpu_count = multiprocessing.cpu_count()
+    workers = int(workers or 1)
+    if workers <= 0:
+        workers = cpu_count + workers + 1
+    return max(1, min(workers, cpu_count))
+
+
+def process_pool_map(function, argument_tuples, workers=1):
+    """Runs function(*arguments) for each argument tuple and returns the results in input order. More than one
+    worker runs the calls in a spawned process pool, so function must be importable at module level. Inside ArcGIS
+    Pro the running executable is not python, so workers are started with the python executable of the install.
+    :param - function - module level function to call
+    :param - argument_tuples - list of argument tuples, one per call
+    :param - workers - worker count passed to resolve_worker_count
+    :returns - list of results"""
+    argument_tuples = list(argument_tuples)
+    workers = min(resolve_worker_count(workers), len(argument_tuples))
+    if workers <= 1:
+        return [function(*arguments) for arguments in argument_tuples]
+    context = multiprocessing.get_context("spawn")
+    python_exe = os.path.join(
+        sys.exec_prefix,
+        "python.exe" if os.name == "nt" else os.path.join("bin", "python"),
+    )
+    if not os.path.basename(sys.executable).lower().startswith(
+        "python"
+    ) and os.path.exists(python_exe):
+        context.set_executable(python_exe)
+    with context.Pool(workers) as pool:
+        return pool.starmap(function, argument_tuples)
+
+
+###########################
+# Partitions
+###########################
+
+
+def partition_order(codes):
+    """Orders rows by partition code with one stable sort, so every partition is one contiguous run of rows. Rows
+    with negative codes belong to no partition and are dropped.
+    :param - codes - (N,) integer partition code of every row
+    :returns - tuple of (order (M,) row positions sorted by code, bounds (P + 1,) start and end of each partition
+        in order, partition_codes (P,) sorted unique codes)"""
+    codes = np.asarray(codes)
+    valid_rows = np.flatnonzero(codes >= 0)
+    order, segment_starts, partition_codes = segment_sort(codes[valid_rows])
+    return valid_rows[order], np.r_[segment_starts, len(valid_rows)], partition_codes
+
+
+def frame_partitions(frame, codes):
+    """Yields the partitions of a DataFrame in code order. The frame is reordered once and each partition is a
+    contiguous slice of the reordered frame, so per partition work does not rescan the rows.
+    :param - frame - pandas DataFrame
+    :param - codes - (N,) integer partition code of every row, negative for rows in no partition
+    :returns - generator of (code, DataFrame slice) tuples"""
+    order, bounds, partition_codes = partition_order(codes)
+    sorted_frame = frame.iloc[order]
+    for index, code in enumerate(partition_codes.tolist()):
+        yield code, sorted_frame.iloc[bounds[index] : bounds[index + 1]]
+
+
+def time_bin_codes(start_times, nested_time_bin_pairs, end_times=None):
+    """Assigns every row the index of the time bin it falls in, matching the queries of
+    construct_sql_queries_from_time_bin: a row is in a bin when its start time is at or after the bin start and its
+    end time is before the bin end. Bins must be sorted and not overlap.
+    :param - start_times - (N,) datetimes of the start time field
+    :param - nested_time_bin_pairs - list of [start, end] datetime pairs from construct_time_bin_ranges
+    :param - end_times - optional (N,) datetimes of the end time field, defaults to the start times
+    :returns - (N,) int64 bin index of every row, -1 for rows in no bin or with null times
+    """
+    start_times = pd.to_datetime(pd.Series(start_times)).to_numpy("datetime64[ns]")
+    end_times = (
+        start_times
+        if end_times is None
+        else pd.to_datetime(pd.Series(end_times)).to_numpy("datetime64[ns]")
+    )
+    bin_starts = pd.to_datetime(
+        [time_bin[0] for time_bin in nested_time_bin_pairs]
+    ).to_numpy("datetime64[ns]")
+    bin_ends = pd.to_datetime(
+        [time_bin[1] for time_bin in nested_time_bin_pairs]
+    ).to_numpy("datetime64[ns]")
+    codes = np.searchsorted(bin_starts, start_times, side="right") - 1
+    valid = (codes >= 0) & ~np.isnat(start_times)
+    valid[valid] = end_times[valid] < bin_ends[codes[valid]]
+    return np.where(valid, codes, -1).astype("int64")
+
+
+def time_bin_partitions(
+    in_table,
+    nested_time_bin_pairs,
+    start_time_field,
+    end_time_field=None,
+    fields=[],
+    query="",
+):
+    """Reads a table once and yields its rows partitioned by time bin, replacing one query and table scan per bin
+    from construct_sql_queries_from_time_bin.
+    :param - in_table - input table or feature class
+    :param - nested_time_bin_pairs - list of [start, end] datetime pairs from construct_time_bin_ranges
+    :param - start_time_field - start time field
+    :param - end_time_field - optional end time field, defaults to the start time field
+    :param - fields - other fields or tokens (such as SHAPE@X) to read for each partition
+    :param - query - sql query to grab appropriate rows
+    :returns - generator of (bin index, DataFrame indexed by object ID) tuples for bins with rows
+    """
+    end_time_field = end_time_field or start_time_field
+    read_fields = []
+    for field in [start_time_field, end_time_field] + list(fields):
+        if field not in read_fields:
+            read_fields.append(field)
+    frame = arcgis_table_to_df(in_table, read_fields, query)
+    codes = time_bin_codes(
+        frame[start_time_field], nested_time_bin_pairs, frame[end_time_field]
+    )
+    return frame_partitions(frame, codes)
+
+
+def group_partitions(in_table, group_fields, fields=[], query=""):
+    """Reads a table once and yields its rows partitioned by every unique combination of group field values,
+    replacing one construct_sql_equality_query or chained query and table scan per group. Null values form their
+    own groups.
+    :param - in_table - input table or feature class
+    :param - group_fields - fields whose unique value combinations define the partitions
+    :param - fields - other fields or tokens to read for each partition
+    :param - query - sql query to grab appropriate rows
+    :returns - generator of (tuple of group values, DataFrame indexed by object ID) tuples in first read order
+    """
+    group_fields = list(group_fields)
+    read_fields = group_fields + [
+        field for field in fields if field not in group_fields
+    ]
+    frame = arcgis_table_to_df(in_table, read_fields, query)
+    codes = frame.groupby(group_fields, sort=False, dropna=False).ngroup()
+    for _, partition in frame_partitions(frame, codes.to_numpy(dtype="int64")):
+        yield tuple(partition[group_fields].iloc[0].tolist()), partition
+
+
 ###########################
 # ArcTime
 ###########################
@@ -552,10 +2981,12 @@ def round_new_datetime(
 
 
 def get_min_max_from_field(table, field):
-    """Get min and max value from input feature class/table."""
-    with arcpy.da.SearchCursor(table, [field]) as cursor:
-        data = [row[0] for row in cursor if row[0]]
-        return min(data), max(data)
+    """Get min and max value from input feature class/table. The field is read into a numpy array and reduced in
+    one vectorized pass, skipping nulls. Date fields return datetimes."""
+    values = arcpy.da.TableToNumPyArray(table, [field], skip_nulls=True)[field]
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype("datetime64[us]")
+    return values.min().item(), values.max().item()
 
 
 @arc_tool_report
@@ -663,6 +3094,125 @@ def parse_time_units_to_dt(float_magnitude, time_units):
     )
 
 
+def parse_time_bin_interval(time_interval):
+    """Parses a time interval such as "6 hours", "1 month" or "2 years" into a bin width. Month and year intervals
+    are calendar aware and returned as a number of months, other units are parsed by parse_time_units_to_dt.
+    :param - time_interval - time interval string or datetime.timedelta
+    :returns - tuple of (months, time_delta), where months is 0 for fixed width bins and time_delta is None for
+        calendar bins"""
+    if isinstance(time_interval, datetime.timedelta):
+        return 0, time_interval
+    magnitude, units = alphanumeric_split(str(time_interval))
+    if re.search(r"month", units):
+        return int(magnitude), None
+    if re.search(r"year", units):
+        return int(magnitude) * 12, None
+    return 0, parse_time_units_to_dt(magnitude, units)
+
+
+def datetime_bin_codes(
+    start_times, time_interval, bin_start=None, bin_end=None, end_times=None
+):
+    """Assigns every row a time bin in one vectorized pass over datetime64[ns] values. Fixed width bins use floor
+    division of the time since the bin start. Month and year bins are calendar aware: bin edges step whole months
+    from the bin start, keeping its day and time (clamped to the end of shorter months), so a fiscal year can start
+    on July 1st. Without a bin start, they begin on the first day of the month (or January for years) of the earliest
+    start time. Rows are placed in calendar bins with a binary search over the edges. With
+    end times, a row is only in the bin of its start time if it also ends before that bin ends, matching the
+    queries of construct_sql_queries_from_time_bin.
+    :param - start_times - (N,) datetimes of the start time field
+    :param - time_interval - bin width as a time interval string or timedelta (see parse_time_bin_interval)
+    :param - bin_start - optional datetime of the first bin, defaults to the earliest start time (snapped to the
+        start of its month or year for calendar bins)
+    :param - bin_end - optional datetime after which rows are not binned, defaults to the latest start time
+    :param - end_times - optional (N,) datetimes of the end time field
+    :returns - tuple of (codes (N,) int64 bin index of every row, -1 for rows in no bin or with null times,
+        bin_edges (B + 1,) datetime64[ns] bin boundaries)"""
+    start_times = pd.to_datetime(pd.Series(start_times)).to_numpy("datetime64[ns]")
+    valid = ~np.isnat(start_times)
+    snap_start = bin_start is None
+    if bin_start is None:
+        bin_start = start_times[valid].min() if valid.any() else np.datetime64(0, "ns")
+    if bin_end is None:
+        bin_end = start_times[valid].max() if valid.any() else bin_start
+    bin_start = np.datetime64(pd.Timestamp(bin_start), "ns")
+    bin_end = np.datetime64(pd.Timestamp(bin_end), "ns")
+    months, time_delta = parse_time_bin_interval(time_interval)
+    if months:
+        first_month = int(bin_start.astype("datetime64[M]").astype("int64"))
+        if snap_start:
+            if months % 12 == 0:
+                first_month -= first_month % 12
+            bin_start = np.datetime64(first_month, "M").astype("datetime64[ns]")
+        start_day = bin_start.astype("datetime64[D]")
+        day_offset = int((start_day - np.datetime64(first_month, "M")).astype("int64"))
+        time_offset = bin_start - start_day
+        # Enough edges to pass the bin end, trimmed after the bin that holds it
+        last_month = int(bin_end.astype("datetime64[M]").astype("int64"))
+        edge_months = (
+            first_month + np.arange((last_month - first_month) // months + 2) * months
+        )
+        month_starts = edge_months.astype("datetime64[M]").astype("datetime64[D]")
+        month_days = (
+            (edge_months + 1).astype("datetime64[M]").astype("datetime64[D]")
+            - month_starts
+        ).astype("int64")
+        bin_edges = (month_starts + np.minimum(day_offset, month_days - 1)).astype(
+            "datetime64[ns]"
+        ) + time_offset
+        bin_count = int(np.searchsorted(bin_edges, bin_end, side="right"))
+        bin_edges = bin_edges[: bin_count + 1]
+        codes = (
+            np.searchsorted(bin_edges, start_times, side="right").astype("int64") - 1
+        )
+    else:
+        width = np.timedelta64(pd.Timedelta(time_delta)).astype("timedelta64[ns]")
+        # Integer nanoseconds keep null times out of the floor division
+        codes = (start_times - bin_start).astype("int64") // width.astype("int64")
+        bin_count = int((bin_end - bin_start) // width) + 1
+        bin_edges = bin_start + np.arange(bin_count + 1) * width
+    valid &= (start_times >= bin_start) & (codes < bin_count)
+    if end_times is not None:
+        end_times = pd.to_datetime(pd.Series(end_times)).to_numpy("datetime64[ns]")
+        valid[valid] = end_times[valid] < bin_edges[codes[valid] + 1]
+    return np.where(valid, codes, -1).astype("int64"), bin_edges
+
+
+def bin_statistics(
+    codes,
+    values,
+    bin_count,
+    merge_rules=("COUNT", "MEAN", "MEDIAN", "SUM", "STD", "MIN", "MAX"),
+):
+    """Computes statistics of a value field for every bin without a per bin query. COUNT, SUM, MEAN, MIN, MAX and
+    RANGE are scattered into their bins with scatter_merge_rule, and other merge rules sort the rows by bin once
+    and reduce the segments with merge_rule_reduce. Null values are skipped.
+    :param - codes - (N,) bin index of every row, negative for rows in no bin
+    :param - values - (N,) values to summarize
+    :param - bin_count - number of bins
+    :param - merge_rules - merge rules (see MERGE_RULES) to compute, one column each
+    :returns - (B, len(merge_rules)) float64 array, NaN for statistics of empty bins (0 for COUNT)
+    """
+    codes = np.asarray(codes)
+    binned = codes >= 0
+    codes = codes[binned]
+    values = np.asarray(values, dtype="float64")[binned][:, None]
+    statistics = np.full((int(bin_count), len(merge_rules)), np.nan)
+    order, segment_starts, bin_ids = None, None, None
+    for column, merge_rule in enumerate(merge_rules):
+        if str(merge_rule).upper() in SCATTER_MERGE_RULES:
+            statistics[:, column] = scatter_merge_rule(
+                codes, values, bin_count, merge_rule
+            )[:, 0]
+            continue
+        if order is None:
+            order, segment_starts, bin_ids = segment_sort(codes)
+        statistics[bin_ids, column] = merge_rule_reduce(
+            values[order], segment_starts, merge_rule
+        )[:, 0]
+    return statistics
+
+
 @arc_tool_report
 def create_unique_field_name(field_name, in_table):
     """This function will be used to create a unique field name for an ArcGIS field by adding a number to the end.